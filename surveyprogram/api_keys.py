@@ -0,0 +1,116 @@
+import os
+import hmac
+import time
+import logging
+import sqlite3
+import hashlib
+import threading
+
+# The userManage database that mints per-user API keys, and how often to follow its
+# api_key_changes feed
+USER_DB_PATH = os.getenv("USER_DB_PATH", os.path.join("..", "userManage", "user_management.db"))
+API_KEY_REFRESH_SECONDS = float(os.getenv("API_KEY_REFRESH_SECONDS", "5"))
+# Changed emails looked up per query, well under SQLite's bound-parameter limit
+LOOKUP_BATCH_SIZE = 500
+
+
+def hash_key(api_key):
+    return hashlib.sha256(api_key.encode()).digest()
+
+
+# In-memory index of userManage API keys, by SHA-256 digest. It is loaded once and then
+# kept current from the change feed in a background thread, so authenticating a request
+# is a dict lookup with no database access.
+class ApiKeyIndex:
+    def __init__(self, db_path=USER_DB_PATH, refresh_seconds=API_KEY_REFRESH_SECONDS):
+        self.db_path = db_path
+        self.refresh_seconds = refresh_seconds
+        self.loaded = False
+        self._by_hash = {}
+        self._by_email = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=5)
+
+    def load(self):
+        conn = self._connect()
+        try:
+            # One read transaction, so the snapshot and the feed position agree
+            conn.execute("BEGIN")
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM api_key_changes").fetchone()[0]
+            rows = conn.execute("SELECT email, api_key FROM users WHERE api_key IS NOT NULL").fetchall()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        by_email = {email: hash_key(api_key) for email, api_key in rows}
+        with self._lock:
+            self._by_email = by_email
+            self._by_hash = {digest: email for email, digest in by_email.items()}
+            self._seq = seq
+            self.loaded = True
+        logging.info("Loaded %s API keys (change feed at %s).", len(by_email), seq)
+
+    # The feed lists the emails whose key changed; their current keys are re-read from
+    # users in the same read transaction
+    def refresh(self):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            changes = conn.execute(
+                "SELECT seq, email FROM api_key_changes WHERE seq > ? ORDER BY seq", (self._seq,)
+            ).fetchall()
+            emails = [email for seq, email in changes]
+            digests = {}
+            for start in range(0, len(emails), LOOKUP_BATCH_SIZE):
+                batch = emails[start:start + LOOKUP_BATCH_SIZE]
+                rows = conn.execute(
+                    f"SELECT email, api_key FROM users WHERE email IN ({','.join('?' * len(batch))}) AND api_key IS NOT NULL",
+                    batch
+                ).fetchall()
+                digests.update((email, hash_key(api_key)) for email, api_key in rows)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        if not changes:
+            return
+
+        with self._lock:
+            for email in emails:
+                old_digest = self._by_email.pop(email, None)
+                if old_digest is not None:
+                    self._by_hash.pop(old_digest, None)
+                digest = digests.get(email)
+                if digest is not None:
+                    self._by_email[email] = digest
+                    self._by_hash[digest] = email
+            self._seq = changes[-1][0]
+
+    def _follow(self):
+        while True:
+            time.sleep(self.refresh_seconds)
+            try:
+                if self.loaded:
+                    self.refresh()
+                else:
+                    self.load()
+            except sqlite3.Error as e:
+                logging.warning("API key index refresh failed: %s", e)
+
+    def start(self):
+        try:
+            self.load()
+        except sqlite3.Error as e:
+            logging.warning("API key index could not be loaded from %s, retrying: %s", self.db_path, e)
+        threading.Thread(target=self._follow, daemon=True).start()
+
+    # Returns the email owning the key, or None
+    def lookup(self, api_key):
+        digest = hash_key(api_key)
+        email = self._by_hash.get(digest)
+        if email is None:
+            return None
+        stored = self._by_email.get(email)
+        return email if stored is not None and hmac.compare_digest(stored, digest) else None
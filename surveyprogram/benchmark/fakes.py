@@ -0,0 +1,145 @@
+import time
+import queue
+import threading
+import collections
+from types import SimpleNamespace
+import pika
+import redis
+from pika.exceptions import UnroutableError
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+# Just enough of pika's BlockingConnection for main.py, worker.py and the publisher:
+# durable queues live in this process, deliveries honour basic_qos and acks, and
+# add_callback_threadsafe works as it does against a real broker.
+class InProcessBroker:
+    def __init__(self):
+        self.queues = {}
+        self.changed = threading.Condition()
+
+    def declare(self, name):
+        with self.changed:
+            return self.queues.setdefault(name, collections.deque())
+
+    def notify(self):
+        with self.changed:
+            self.changed.notify_all()
+
+
+class InProcessChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.consumers = []
+        self.prefetch = 0
+        self.unacked = 0
+        self.next_tag = 0
+        self.consuming = False
+
+    def queue_declare(self, queue, durable=False, passive=False, **kwargs):
+        messages = self.broker.declare(queue)
+        return SimpleNamespace(method=SimpleNamespace(queue=queue, message_count=len(messages)))
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_qos(self, prefetch_count=0, **kwargs):
+        self.prefetch = prefetch_count
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        if routing_key not in self.broker.queues:
+            if mandatory:
+                raise UnroutableError([])
+            return
+        self.broker.queues[routing_key].append((body, properties))
+        self.broker.notify()
+
+    def basic_consume(self, queue, on_message_callback, **kwargs):
+        self.broker.declare(queue)
+        self.consumers.append((queue, on_message_callback))
+
+    def basic_ack(self, delivery_tag, **kwargs):
+        self.unacked -= 1
+
+    # Hand out deliveries up to the prefetch limit; returns how many were delivered
+    def dispatch(self):
+        delivered = 0
+        for queue_name, callback in self.consumers:
+            messages = self.broker.queues[queue_name]
+            while messages and not (self.prefetch and self.unacked >= self.prefetch):
+                try:
+                    body, properties = messages.popleft()
+                except IndexError:
+                    break
+                self.unacked += 1
+                self.next_tag += 1
+                method = SimpleNamespace(delivery_tag=self.next_tag, routing_key=queue_name)
+                callback(self, method, properties, body)
+                delivered += 1
+        return delivered
+
+    def start_consuming(self):
+        self.consuming = True
+        while self.consuming:
+            self.connection.process_data_events(time_limit=0.05)
+
+    def stop_consuming(self):
+        self.consuming = False
+
+
+class InProcessConnection:
+    def __init__(self, broker, parameters=None):
+        self.broker = broker
+        self.channels = []
+        self.callbacks = queue.Queue()
+        self.is_open = True
+        self.is_closed = False
+
+    def channel(self):
+        channel = InProcessChannel(self)
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.put(callback)
+        self.broker.notify()
+
+    def process_data_events(self, time_limit=0):
+        deadline = time.monotonic() + (time_limit or 0)
+        while True:
+            busy = False
+            while True:
+                try:
+                    self.callbacks.get_nowait()()
+                    busy = True
+                except queue.Empty:
+                    break
+            if sum(channel.dispatch() for channel in self.channels):
+                busy = True
+            remaining = deadline - time.monotonic()
+            if busy or remaining <= 0:
+                return
+            with self.broker.changed:
+                self.broker.changed.wait(remaining)
+
+    def close(self):
+        self.is_open = False
+        self.is_closed = True
+
+
+# Point redis and pika at in-process stand-ins. Must run before main.py or worker.py
+# is imported, since both connect at import time.
+def install():
+    if fakeredis is None:
+        raise SystemExit("The benchmark needs fakeredis (pip install fakeredis).")
+
+    server = fakeredis.FakeServer()
+    redis.StrictRedis = redis.Redis = lambda *args, **kwargs: fakeredis.FakeStrictRedis(server=server)
+
+    broker = InProcessBroker()
+    pika.BlockingConnection = lambda parameters=None: InProcessConnection(broker, parameters)
+    return broker
@@ -0,0 +1,229 @@
+"""Offline benchmark for the scrapers and the enqueue -> worker -> status path.
+
+flipp.com and its flyer API are replaced by a local fixture server, Redis by fakeredis
+and RabbitMQ by an in-process queue, so runs are repeatable and need no network.
+
+    python benchmark/run.py                   # run and compare with benchmark/baseline.json
+    python benchmark/run.py --save-baseline   # record the current numbers as the baseline
+
+Exits non-zero when a metric regressed past --tolerance against the baseline.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import resource
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from server import FixtureServer  # noqa: E402
+import fakes  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+POSTAL_CODE = "P7A1A1"
+
+# metric -> True when bigger is better
+METRICS = {
+    "jobs_per_sec": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "protocol_calls_per_run": False,
+    "peak_rss_mb": False,
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(latencies_s, elapsed_s):
+    return {
+        "runs": len(latencies_s),
+        "jobs_per_sec": round(len(latencies_s) / elapsed_s, 2),
+        "p50_ms": round(percentile(latencies_s, 0.5) * 1000, 1),
+        "p99_ms": round(percentile(latencies_s, 0.99) * 1000, 1),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux; children covers the Playwright driver and Chromium
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round((own + children) / 1024, 1)
+
+
+def flyer_url(number):
+    return f"https://flipp.com/en-ca/thunder-bay-on/flyer/{7000000 + number}-bench?postal_code={POSTAL_CODE}"
+
+
+def bench_scrape_flyer(runs):
+    from get_flyer import scrape_flyer
+
+    latencies = []
+    started = time.monotonic()
+    for number in range(runs):
+        run_started = time.monotonic()
+        scrape_flyer(flyer_url(number))
+        latencies.append(time.monotonic() - run_started)
+    return summarize(latencies, time.monotonic() - started)
+
+
+# Enqueue every job through the API, let an in-process worker drain the queue, and
+# time each job from enqueue to completion as recorded on its job record
+def bench_end_to_end(runs):
+    import threading
+    import main
+    import worker
+
+    threading.Thread(target=worker.run_worker, args=(["fast"], 0), daemon=True).start()
+    client = main.app.test_client()
+    headers = {"X-API-Key": os.environ["API_KEY"]}
+
+    started = time.monotonic()
+    job_ids = []
+    for number in range(runs):
+        # A distinct flyer per job, so the result cache can't answer for the worker
+        response = client.post("/scrape/url", json={"url": flyer_url(10000 + number)}, headers=headers)
+        job_ids.append(response.json["job_id"])
+
+    latencies = []
+    for job_id in job_ids:
+        job_data = client.get(f"/job/wait/{job_id}?timeout=60").json
+        if job_data["status"] != "completed":
+            raise RuntimeError(f"Job {job_id} ended as {job_data['status']}: {job_data.get('error')}")
+        latencies.append(job_data["finished_at"] - job_data["enqueued_at"])
+    return summarize(latencies, time.monotonic() - started)
+
+
+# Counts messages sent from Python to the Playwright driver: one per awaited page or
+# element call, so it tracks the browser round trips a scrape makes
+class ProtocolCallCounter:
+    def __init__(self):
+        from playwright._impl._connection import Connection
+
+        self.calls = 0
+        original = Connection._send_message_to_server
+
+        def counting(connection, *args, **kwargs):
+            self.calls += 1
+            return original(connection, *args, **kwargs)
+
+        Connection._send_message_to_server = counting
+
+
+async def bench_browser(runs):
+    from browser_pool import BrowserPool
+    from resource_policy import apply_resource_policy
+    from get_categories import scrape_flyer_categories
+    from get_flyers_by_category import scrape_flyers_by_category
+
+    counter = ProtocolCallCounter()
+    pool = BrowserPool(size=1)
+    try:
+        await pool.start()
+    except Exception as e:
+        skipped = {"skipped": f"Chromium could not be launched: {e}".splitlines()[0]}
+        return {"scrape_flyer_categories": skipped, "scrape_flyers_by_category": skipped}
+
+    async def run(job_type, scrape, *args):
+        latencies = []
+        calls_before = counter.calls
+        started = time.monotonic()
+        for _ in range(runs):
+            async with pool.context() as context:
+                await apply_resource_policy(context, job_type)
+                run_started = time.monotonic()
+                if not await scrape(*args, context):
+                    raise RuntimeError(f"{scrape.__name__} returned nothing")
+                latencies.append(time.monotonic() - run_started)
+        stats = summarize(latencies, time.monotonic() - started)
+        stats["protocol_calls_per_run"] = round((counter.calls - calls_before) / runs, 1)
+        return stats
+
+    try:
+        return {
+            "scrape_flyer_categories": await run("categories", scrape_flyer_categories, POSTAL_CODE),
+            "scrape_flyers_by_category": await run("category", scrape_flyers_by_category, "Groceries", POSTAL_CODE),
+        }
+    finally:
+        await pool.close()
+
+
+# Regressions of current against baseline, as readable strings
+def compare(current, baseline, tolerance):
+    regressions = []
+    for name, base_stats in baseline.items():
+        stats = current.get(name)
+        if not isinstance(base_stats, dict) or not isinstance(stats, dict) or "skipped" in stats:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in base_stats or metric not in stats:
+                continue
+            base, value = base_stats[metric], stats[metric]
+            if higher_is_better and value < base * (1 - tolerance):
+                regressions.append(f"{name}.{metric}: {value} < {base} (-{tolerance:.0%} allowed)")
+            elif not higher_is_better and value > base * (1 + tolerance):
+                regressions.append(f"{name}.{metric}: {value} > {base} (+{tolerance:.0%} allowed)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20, help="runs per scraper benchmark")
+    parser.add_argument("--jobs", type=int, default=200, help="jobs in the end-to-end benchmark")
+    parser.add_argument("--listings", type=int, default=96, help="flyers in the fixture listing")
+    parser.add_argument("--items", type=int, default=300, help="items per fixture flyer")
+    parser.add_argument("--no-browser", action="store_true", help="skip the Playwright benchmarks")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+
+    server = FixtureServer(listings=args.listings, items_per_flyer=args.items).start()
+    os.environ.update({
+        "FLIPP_BASE_URL": server.base_url,
+        "FLIPP_FLYERS_API_URL": server.base_url,
+        "API_KEY": "benchmark",
+    })
+    # main.py and the scrapers write logs/ and screenshots/ relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="surveyprogram-bench-"))
+    fakes.install()
+
+    results = {
+        "scrape_flyer": bench_scrape_flyer(args.runs),
+        "end_to_end": bench_end_to_end(args.jobs),
+    }
+    if not args.no_browser:
+        results.update(asyncio.run(bench_browser(args.runs)))
+    results["process"] = {"peak_rss_mb": peak_rss_mb()}
+    server.stop()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one.")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import os
+import re
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+FLYER_ITEMS_PATH = re.compile(r"^/api/flipp/flyers/(\d+)/flyer_items$")
+FLYERS_PAGE_PATH = re.compile(r"^/en-ca/flyers(/[^/]+)?$")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), "rb") as f:
+        return f.read()
+
+
+# Serves the fixtures in place of flipp.com (HTML pages) and flyers-ng.flippback.com
+# (flyer items), both from one local port. Responses are rendered once up front so the
+# server never shows up in the numbers.
+class FixtureServer:
+    def __init__(self, listings=96, items_per_flyer=300, port=0):
+        page = load_fixture("flyers.html").replace(b"__TOTAL__", str(listings).encode())
+        items = json.loads(load_fixture("flyer_items.json"))
+        # Repeat the fixture items until the flyer is as long as asked
+        items = [dict(items[i % len(items)], id=items[i % len(items)]["id"] + i) for i in range(items_per_flyer)]
+        flyer_items = json.dumps(items).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if FLYERS_PAGE_PATH.match(path):
+                    self.respond(200, "text/html; charset=utf-8", page)
+                elif FLYER_ITEMS_PATH.match(path):
+                    self.respond(200, "application/json", flyer_items)
+                else:
+                    self.respond(404, "text/plain", b"not found")
+
+            def respond(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
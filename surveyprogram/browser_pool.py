@@ -0,0 +1,160 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright
+from metrics import STAGE_SECONDS, span
+
+# Pool configuration. Each job holds a whole browser, so by default there is one per
+# browser job a worker runs at once (WORKER_CONCURRENCY).
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", os.getenv("WORKER_CONCURRENCY", "4")))
+BROWSER_MAX_USES = int(os.getenv("BROWSER_MAX_USES", "50"))
+BROWSER_MAX_MEMORY_MB = int(os.getenv("BROWSER_MAX_MEMORY_MB", "1024"))
+BROWSER_HEADLESS = os.getenv("BROWSER_HEADLESS", "true").lower() != "false"
+
+
+def process_rss_mb(pid):
+    # Resident set size of a single process, read straight from /proc (Linux only)
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class PooledBrowser:
+    def __init__(self):
+        self.browser = None
+        self.uses = 0
+
+    def is_alive(self):
+        return self.browser is not None and self.browser.is_connected()
+
+    async def memory_mb(self):
+        # Sum RSS over every Chromium process (browser, renderers, GPU) owned by this browser
+        try:
+            session = await self.browser.new_browser_cdp_session()
+            info = await session.send("SystemInfo.getProcessInfo")
+            await session.detach()
+        except Exception:
+            return 0
+        return sum(process_rss_mb(proc["id"]) for proc in info.get("processInfo", []))
+
+    async def close(self):
+        if self.browser is not None:
+            try:
+                await self.browser.close()
+            except Exception:
+                pass
+        self.browser = None
+        self.uses = 0
+
+
+class BrowserPool:
+    def __init__(self, size=BROWSER_POOL_SIZE, max_uses=BROWSER_MAX_USES,
+                 max_memory_mb=BROWSER_MAX_MEMORY_MB, headless=BROWSER_HEADLESS):
+        self.size = size
+        self.max_uses = max_uses
+        self.max_memory_mb = max_memory_mb
+        self.headless = headless
+        self._playwright = None
+        self._slots = []
+        self._idle = None
+
+        # Counters behind get_stats()
+        self.launches = 0
+        self.cold_acquires = 0
+        self.acquires = 0
+        self.recycled = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    async def start(self):
+        self._playwright = await async_playwright().start()
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            slot = PooledBrowser()
+            await self._launch(slot)
+            self._slots.append(slot)
+            self._idle.put_nowait(slot)
+
+    async def close(self):
+        for slot in self._slots:
+            await slot.close()
+        self._slots = []
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def _launch(self, slot):
+        with span("browser", "launch"):
+            slot.browser = await self._playwright.chromium.launch(headless=self.headless)
+        slot.uses = 0
+        self.launches += 1
+
+    async def _should_recycle(self, slot):
+        if not slot.is_alive():
+            return True
+        if self.max_uses and slot.uses >= self.max_uses:
+            return True
+        if self.max_memory_mb and await slot.memory_mb() >= self.max_memory_mb:
+            return True
+        return False
+
+    # Hand out an isolated BrowserContext on an already-running browser
+    @asynccontextmanager
+    async def context(self, **context_options):
+        started = time.monotonic()
+        slot = await self._idle.get()
+        wait_ms = (time.monotonic() - started) * 1000
+        self.acquires += 1
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        STAGE_SECONDS.observe(wait_ms / 1000, job_type="browser", stage="acquire")
+
+        context = None
+        try:
+            # The slot is empty after a recycle or a crash; launch lazily so a failed
+            # launch only fails the current job instead of shrinking the pool
+            if not slot.is_alive():
+                await slot.close()
+                await self._launch(slot)
+                self.cold_acquires += 1
+            context = await slot.browser.new_context(**context_options)
+            slot.uses += 1
+            yield context
+        finally:
+            if context is not None:
+                try:
+                    await context.close()
+                except Exception:
+                    pass
+            if await self._should_recycle(slot):
+                self.recycled += 1
+                await slot.close()
+            self._idle.put_nowait(slot)
+
+    def get_stats(self):
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle else 0,
+            "acquires": self.acquires,
+            "launches": self.launches,
+            "launches_avoided": self.acquires - self.cold_acquires,
+            "recycled": self.recycled,
+            "avg_wait_ms": round(self.total_wait_ms / self.acquires, 2) if self.acquires else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 2),
+        }
+
+
+# One-off browser for running a scraper outside the worker (e.g. from a script)
+@asynccontextmanager
+async def launch_context(headless=BROWSER_HEADLESS, **context_options):
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=headless)
+        try:
+            context = await browser.new_context(**context_options)
+            yield context
+        finally:
+            await browser.close()
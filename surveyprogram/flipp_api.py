@@ -0,0 +1,196 @@
+import re
+from datetime import datetime
+from urllib.parse import urlparse
+import http_client
+from flipp_site import FLIPP_BASE_URL
+from resource_policy import domain_matches
+from get_flyers_by_category import SORTING_OPTIONS
+from flyer_delta import flyer_id
+
+# Backend hosts the flipp.com front end loads its flyer JSON from
+API_HOSTS = ["flippback.com", "wishabi.com", "wishabi.net"]
+
+# Redis keys: the learned endpoint template ("{postal_code}" placeholder) and, per job
+# type, the parts of its result the fast path reproduced in a browser scrape ("pills" for
+# categories, whose names and counts came back in the same order; for category, the sort
+# orders whose flyers came back in the same order)
+ENDPOINT_KEY = "flipp_api:endpoint"
+VERIFIED_KEY = "flipp_api:verified:{job_type}"
+
+def normalize_postal_code(postal_code):
+    return re.sub(r"\s+", "", postal_code).upper()
+
+
+def slugify(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+def fetch_json(url):
+    response = http_client.get(url)
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch data from API. Status code: {response.status_code}")
+    return response.json()
+
+
+# The flyer list payload: {"flyers": [{"id", "merchant", "categories", "valid_to", ...}]}
+def flyers_from_payload(data):
+    flyers = data.get("flyers") if isinstance(data, dict) else None
+    if not isinstance(flyers, list):
+        return None
+    if not all(isinstance(flyer, dict) and "id" in flyer and "categories" in flyer for flyer in flyers):
+        return None
+    return flyers
+
+
+def fetch_flyers(redis_client, postal_code):
+    template = redis_client.get(ENDPOINT_KEY)
+    if not template:
+        raise Exception("No flyer API endpoint has been discovered yet.")
+    url = template.decode().replace("{postal_code}", normalize_postal_code(postal_code))
+    flyers = flyers_from_payload(fetch_json(url))
+    if flyers is None:
+        raise Exception("Flyer API returned an unexpected schema.")
+    return flyers
+
+
+def fetch_categories(redis_client, postal_code):
+    counts = {}
+    for flyer in fetch_flyers(redis_client, postal_code):
+        for name in flyer["categories"]:
+            counts[name] = counts.get(name, 0) + 1
+
+    # Same shape as scrape_flyer_categories
+    return [{"name": name, "count": str(count)} for name, count in counts.items()]
+
+
+def format_valid_until(valid_to):
+    try:
+        valid_to = datetime.fromisoformat(valid_to)
+    except (TypeError, ValueError):
+        return "Unknown"
+    return f"Valid until {valid_to:%b} {valid_to.day}"
+
+
+def listing_from_flyer(flyer, postal_code):
+    merchant = flyer.get("merchant") or flyer.get("name") or "Unknown"
+    return {
+        "name": merchant,
+        "valid_until": format_valid_until(flyer.get("valid_to")),
+        "image_url": flyer.get("thumbnail_url"),
+        "source_link": f"{FLIPP_BASE_URL}/en-ca/flyer/{flyer['id']}-{slugify(merchant)}?postal_code={postal_code}",
+    }
+
+
+def fetch_flyers_by_category(redis_client, category, postal_code):
+    postal_code = normalize_postal_code(postal_code)
+    flyers = fetch_flyers(redis_client, postal_code)
+    if category.lower() != "all flyers":
+        flyers = [flyer for flyer in flyers if category.lower() in (name.lower() for name in flyer["categories"])]
+
+    # The API returns flyers in featured order; the other two orders are derived locally
+    orders = {
+        "featured": flyers,
+        "latest": sorted(flyers, key=lambda flyer: flyer.get("valid_from") or "", reverse=True),
+        "alphabetical": sorted(flyers, key=lambda flyer: (flyer.get("merchant") or "").lower()),
+    }
+
+    # Same shape as scrape_flyers_by_category
+    return {option: [listing_from_flyer(flyer, postal_code) for flyer in orders[option]] for option in SORTING_OPTIONS}
+
+
+FETCHERS = {
+    "categories": fetch_categories,
+    "category": fetch_flyers_by_category,
+}
+
+
+def verified(redis_client, job_type):
+    value = redis_client.get(VERIFIED_KEY.format(job_type=job_type))
+    return value.decode().split(",") if value else []
+
+
+def is_verified(redis_client, job_type):
+    # Flags from before sort orders, and category counts and order, were verified don't count
+    if job_type == "category":
+        return any(option in SORTING_OPTIONS for option in verified(redis_client, job_type))
+    if job_type == "categories":
+        return "pills" in verified(redis_client, job_type)
+    return bool(verified(redis_client, job_type))
+
+
+# Sort orders a verified category fast path can't serve, left to the browser
+def unverified_options(redis_client, job_type):
+    if job_type != "category":
+        return []
+    return [option for option in SORTING_OPTIONS if option not in verified(redis_client, job_type)]
+
+
+def invalidate(redis_client, job_type):
+    redis_client.delete(VERIFIED_KEY.format(job_type=job_type))
+
+
+# Serve a job straight from the API, with the same arguments as the matching scraper
+def fetch(redis_client, job_type, *args):
+    return FETCHERS[job_type](redis_client, *args)
+
+
+# Record the backend JSON URLs a scrape's pages fetch
+def capture_api_urls(context):
+    urls = []
+
+    def on_response(response):
+        if response.request.resource_type not in ("xhr", "fetch") or response.status != 200:
+            return
+        if domain_matches(urlparse(response.url).hostname or "", API_HOSTS):
+            urls.append(response.url)
+
+    context.on("response", on_response)
+    return urls
+
+
+# Flyer ids in listing order
+def flyer_ids(listings):
+    return [flyer_id(listing) for listing in listings if flyer_id(listing)]
+
+
+# (name, count) per category, in the order given
+def category_pills(categories):
+    return [(category["name"], str(category["count"])) for category in categories]
+
+
+# The fast path only takes over what it reproduces from the browser scrape. Categories
+# are compared as ordered (name, count) pills, and category sort orders as ordered flyer
+# ids, since latest and alphabetical are re-sorted locally and may not match the site's;
+# only the orders that match are served from the API.
+def verified_parts(job_type, fast_result, scraped_result):
+    if job_type == "categories":
+        return ["pills"] if category_pills(fast_result) == category_pills(scraped_result) else []
+    if job_type == "category":
+        return [option for option in SORTING_OPTIONS
+                if flyer_ids(fast_result[option]) == flyer_ids(scraped_result.get(option, []))]
+    return []
+
+
+# After a browser scrape, find the flyer list endpoint among the captured URLs and check
+# that serving the same job from it gives the same data
+def discover(redis_client, job_type, api_urls, scraped_result, *args):
+    if not scraped_result:
+        return
+    postal_code = normalize_postal_code(args[-1])
+    # The page may send the code as "P7A1A1", "P7A 1A1", "P7A+1A1" or "P7A%201A1"
+    pattern = re.compile(re.escape(postal_code[:3]) + r"(?:%20|\+|\s)?" + re.escape(postal_code[3:]), re.IGNORECASE)
+
+    for url in dict.fromkeys(api_urls):
+        if not pattern.search(url):
+            continue
+        try:
+            if flyers_from_payload(fetch_json(url)) is None:
+                continue
+            redis_client.set(ENDPOINT_KEY, pattern.sub("{postal_code}", url))
+            parts = verified_parts(job_type, fetch(redis_client, job_type, *args), scraped_result)
+            if parts:
+                redis_client.set(VERIFIED_KEY.format(job_type=job_type), ",".join(parts))
+                print(f"Fast path verified for '{job_type}' jobs ({', '.join(parts)}) via {url}")
+            return
+        except Exception as e:
+            print(f"Fast path discovery failed for {url}: {e}")
@@ -0,0 +1,6 @@
+import os
+
+# Where the flipp site and its flyer item API are served from. Overridable so the
+# scrapers can be pointed at a local stand-in, as the benchmark harness does.
+FLIPP_BASE_URL = os.getenv("FLIPP_BASE_URL", "https://flipp.com").rstrip("/")
+FLIPP_FLYERS_API_URL = os.getenv("FLIPP_FLYERS_API_URL", "https://flyers-ng.flippback.com").rstrip("/")
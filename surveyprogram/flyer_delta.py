@@ -0,0 +1,143 @@
+import os
+import re
+import json
+import time
+import hashlib
+import job_store
+
+# Last scraped listing per (postal code, category), kept so a refresh only has to find
+# what changed. A refresh that stopped early can't see removals past the stopping point,
+# so every INCREMENTAL_FULL_REFRESH_SECONDS the listing is scraped in full again.
+SNAPSHOT_KEY = "snapshot:category:{postal_code}:{category}"
+SNAPSHOT_TTL = int(os.getenv("SNAPSHOT_TTL", str(7 * 24 * 3600)))
+INCREMENTAL_FULL_REFRESH_SECONDS = int(os.getenv("INCREMENTAL_FULL_REFRESH_SECONDS", str(24 * 3600)))
+# Consecutive known, unchanged flyers in 'latest' order after which the rest of the
+# listing is taken from the snapshot
+KNOWN_RUN_LENGTH = int(os.getenv("KNOWN_RUN_LENGTH", "5"))
+
+
+# Listings are keyed by flyer id: the browser and the JSON API build different links
+# (city slug vs. merchant slug) for the same flyer
+def flyer_id(listing):
+    match = re.search(r'/flyer/(\d+)-', listing.get("source_link") or "")
+    return match.group(1) if match else None
+
+
+# "Valid until Nov 21" / "valid until November 21" -> "nov 21"
+def valid_until_key(text):
+    match = re.search(r'([A-Za-z]{3})[A-Za-z]*\.?\s+(\d{1,2})\b', text or "")
+    return f"{match.group(1).lower()} {int(match.group(2))}" if match else " ".join((text or "").lower().split())
+
+
+# Identifies a flyer's content from what both the browser and the API path report
+# alike: its id and validity date. Names and thumbnail URLs differ between the two.
+def fingerprint(listing):
+    fields = [flyer_id(listing), valid_until_key(listing.get("valid_until"))]
+    return hashlib.sha1(json.dumps(fields).encode()).hexdigest()[:16]
+
+
+# Changes whenever any order, membership or flyer content changes
+def listing_hash(listings):
+    digest = hashlib.sha1()
+    for option in sorted(listings):
+        for listing in listings[option]:
+            digest.update(f"{option}:{fingerprint(listing)}\n".encode())
+    return digest.hexdigest()
+
+
+def by_id(listings):
+    return {flyer_id(listing): listing for flyers in listings.values() for listing in flyers if flyer_id(listing)}
+
+
+# flyer id -> fingerprint for every flyer in a listing
+def known_fingerprints(listings):
+    return {key: fingerprint(listing) for key, listing in by_id(listings).items()}
+
+
+def snapshot_key(postal_code, category):
+    return SNAPSHOT_KEY.format(postal_code=postal_code.replace(" ", "").upper(), category=category.lower())
+
+
+def load_snapshot(redis_client, postal_code, category):
+    blob = redis_client.get(snapshot_key(postal_code, category))
+    return job_store.decode(blob) if blob is not None else None
+
+
+# full is False for an incremental refresh, which keeps the previous full-scrape time
+def save_snapshot(redis_client, postal_code, category, listings, full, previous=None):
+    now = time.time()
+    snapshot = {
+        "taken_at": now,
+        "full_at": now if full or previous is None else previous["full_at"],
+        "listing_hash": listing_hash(listings),
+        "listings": listings,
+    }
+    redis_client.set(snapshot_key(postal_code, category), job_store.encode(snapshot), ex=SNAPSHOT_TTL)
+    return snapshot
+
+
+def needs_full_refresh(snapshot):
+    return snapshot is None or time.time() - snapshot["full_at"] >= INCREMENTAL_FULL_REFRESH_SECONDS
+
+
+# What changed between two listings, by flyer
+def diff(old_listings, new_listings):
+    old, new = by_id(old_listings), by_id(new_listings)
+    return {
+        "added": [listing for key, listing in new.items() if key not in old],
+        "removed": [listing for key, listing in old.items() if key not in new],
+        "changed": [listing for key, listing in new.items() if key in old and fingerprint(old[key]) != fingerprint(listing)],
+    }
+
+
+# Complete the 'latest' order from a refresh that stopped on a run of known flyers: the
+# scraped prefix (ending with that run), then the old order from the end of the run on
+def merge_latest(old_latest, prefix, stopped_early):
+    if not stopped_early or not prefix:
+        return prefix
+    seen = {flyer_id(listing) for listing in prefix}
+    last_id = flyer_id(prefix[-1])
+    old_ids = [flyer_id(listing) for listing in old_latest]
+    tail = old_latest[old_ids.index(last_id) + 1:] if last_id in old_ids else []
+    return prefix + [listing for listing in tail if flyer_id(listing) not in seen]
+
+
+# Rebuild every sort order from a refreshed 'latest' order. Alphabetical is re-sorted;
+# featured keeps the old ranking, with new flyers after it until the next full scrape.
+def patch_listings(old_listings, latest):
+    current = {flyer_id(listing): listing for listing in latest}
+    featured = [current[flyer_id(listing)] for listing in old_listings.get("featured", []) if flyer_id(listing) in current]
+    ranked = {flyer_id(listing) for listing in featured}
+    featured += [listing for listing in latest if flyer_id(listing) not in ranked]
+    return {
+        "featured": featured,
+        "latest": latest,
+        "alphabetical": sorted(latest, key=lambda listing: listing["name"].lower()),
+    }
+
+
+# Tells scroll_to_end to stop once it has scrolled past KNOWN_RUN_LENGTH consecutive
+# flyers that the snapshot already has, unchanged
+class KnownRunStop:
+    def __init__(self, known, extract, run_length=KNOWN_RUN_LENGTH):
+        self.known = known
+        # extract(page, start) returns the listings rendered from index start on
+        self.extract = extract
+        self.run_length = run_length
+        self.scanned = 0
+        self.run = 0
+        self.stopped = False
+        # Listings up to and including the known run; the rest comes from the snapshot
+        self.end = None
+
+    async def __call__(self, page, count):
+        listings = await self.extract(page, self.scanned)
+        for index, listing in enumerate(listings, start=self.scanned):
+            unchanged = self.known.get(flyer_id(listing)) == fingerprint(listing)
+            self.run = self.run + 1 if unchanged else 0
+            if self.run >= self.run_length:
+                self.stopped = True
+                self.end = index + 1
+                return True
+        self.scanned += len(listings)
+        return False
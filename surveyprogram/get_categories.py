@@ -1,54 +1,65 @@
 import asyncio
-from playwright.async_api import async_playwright
 import json
+from browser_pool import launch_context
+from flipp_site import FLIPP_BASE_URL
+from metrics import span
+from resource_policy import apply_resource_policy
 
-async def scrape_flyer_categories(postal_code):
-    url = f"https://flipp.com/en-ca/flyers/groceries?postal_code={postal_code}"
-    
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=False)
-        page = await browser.new_page()
+# Runs in the page: returns [name, count] per category link, null where a span is missing
+EXTRACT_CATEGORIES_JS = """
+section => Array.from(section.querySelectorAll('a[is="flipp-link"]'), category => {
+    const name = category.querySelector('span[flex-grow="true"]');
+    const count = category.querySelector('span.pill');
+    return [name ? name.innerText : null, count ? count.innerText : null];
+})
+"""
 
+async def scrape_flyer_categories(postal_code, context=None):
+    # Without a pooled context (e.g. when run as a script) launch a throwaway browser
+    if context is None:
+        async with launch_context() as context:
+            await apply_resource_policy(context, "categories")
+            return await scrape_flyer_categories(postal_code, context)
+
+    url = f"{FLIPP_BASE_URL}/en-ca/flyers/groceries?postal_code={postal_code}"
+
+    page = await context.new_page()
+    try:
         # Navigate to the URL
         print(f"Navigating to {url}")
-        await page.goto(url)
-        
-       
-        await page.wait_for_load_state('networkidle')
+        with span("categories", "goto"):
+            await page.goto(url, wait_until='domcontentloaded')
 
-
-        # Wait for the categories section to be fully visible
+        # Wait for the categories section to be fully visible and populated
         try:
-            await page.wait_for_selector('div.categories', state='visible', timeout=15000)
+            with span("categories", "wait_for_categories"):
+                await page.wait_for_selector('div.categories', state='visible', timeout=15000)
+                await page.wait_for_selector('div.categories a[is="flipp-link"]', state='attached', timeout=15000)
         except Exception as e:
             print("Error: Categories section did not become visible in time:", e)
-            await browser.close()
             return
 
-        categories_section = await page.query_selector('div.categories')
-        categories = await categories_section.query_selector_all('a[is="flipp-link"]')
+        # Pull every category's fields in a single round trip
+        with span("categories", "extract"):
+            categories = await page.eval_on_selector('div.categories', EXTRACT_CATEGORIES_JS)
 
         if not categories:
             print("Error: No categories found after page load.")
-            await browser.close()
             return
         
         # print(f"Found {len(categories)} categories.")
         result = []
-        for category in categories:
-            name = await category.query_selector('span[flex-grow="true"]')
-            count = await category.query_selector('span.pill')
-
-            name_text = await name.inner_text() if name else 'Unknown'
-            count_text = await count.inner_text() if count else '0'
+        for name_text, count_text in categories:
+            name_text = name_text if name_text is not None else 'Unknown'
+            count_text = count_text if count_text is not None else '0'
 
             # print(f"Category: {name_text.strip()}, Count: {count_text.strip()}")  # Debugging output
             result.append({
                 "name": name_text.strip(),
                 "count": count_text.strip()
             })
-        
-        await browser.close()
+    finally:
+        await page.close()
 
     # Return the result in JSON format
     return result
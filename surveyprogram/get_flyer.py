@@ -1,5 +1,46 @@
-import requests
+import os
 import re
+import json
+import codecs
+from concurrent.futures import ThreadPoolExecutor
+import http_client
+from flipp_site import FLIPP_FLYERS_API_URL
+from metrics import span
+
+# Flyers fetched at once by a batch job
+FLYER_FETCH_CONCURRENCY = int(os.getenv("FLYER_FETCH_CONCURRENCY", "8"))
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def iter_json_array(chunks):
+    # Yield the elements of a top-level JSON array as its bytes arrive, so neither the raw
+    # payload nor the full list of raw items is ever held in memory
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    for chunk in chunks:
+        buffer += text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array from the API.")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # The element is cut off at the chunk boundary; wait for more bytes
+            yield item
+        buffer = buffer[pos:]
+    raise ValueError("Truncated JSON array from the API.")
 
 def scrape_flyer(url):
     # Extract the flyer ID from the URL using regex
@@ -9,31 +50,45 @@ def scrape_flyer(url):
     flyer_id = match.group(1)
 
     # API URL
-    api_url = f"https://flyers-ng.flippback.com/api/flipp/flyers/{flyer_id}/flyer_items"
+    api_url = f"{FLIPP_FLYERS_API_URL}/api/flipp/flyers/{flyer_id}/flyer_items"
 
     # Fetch data from the API
-    response = requests.get(api_url)
+    with span("url", "request"):
+        response = http_client.get(api_url, stream=True)
     if response.status_code != 200:
+        response.close()
         raise Exception(f"Failed to fetch data from API. Status code: {response.status_code}")
-    data = response.json()
 
-    # Process the data
+    # Process the data item by item as it streams in
     processed_data = []
-    for item in data:
-        processed_item = {
-            "id": item["id"],
-            "sku": item["flyer_id"],  # Renaming flyer_id to sku
-            "name": item["name"],
-            "cutout_image_url": item["cutout_image_url"],
-            "brand": item["brand"],
-            "valid_from": item["valid_from"],
-            "valid_to": item["valid_to"],
-            "price": item["price"]
-        }
-        processed_data.append(processed_item)
+    with span("url", "stream_items"), response:
+        for item in iter_json_array(response.iter_content(STREAM_CHUNK_SIZE)):
+            processed_item = {
+                "id": item["id"],
+                "sku": item["flyer_id"],  # Renaming flyer_id to sku
+                "name": item["name"],
+                "cutout_image_url": item["cutout_image_url"],
+                "brand": item["brand"],
+                "valid_from": item["valid_from"],
+                "valid_to": item["valid_to"],
+                "price": item["price"]
+            }
+            processed_data.append(processed_item)
 
     return processed_data
 
+def scrape_flyers(urls, concurrency=FLYER_FETCH_CONCURRENCY):
+    # Fetch many flyers concurrently over the shared connection pool.
+    # A flyer that fails is reported in place instead of failing the whole batch.
+    def fetch(url):
+        try:
+            return scrape_flyer(url)
+        except Exception as e:
+            return {"error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(urls)))) as executor:
+        return dict(zip(urls, executor.map(fetch, urls)))
+
 # Example usage
 url = "https://flipp.com/en-ca/thunder-bay-on/flyer/6952741-sephora-holiday?postal_code=P7A1A1"
 # result = process_flyer_data(url)
@@ -0,0 +1,129 @@
+import io
+import os
+import asyncio
+from PIL import Image
+from browser_pool import launch_context
+from metrics import span
+from png_stream import StreamingPNGWriter
+from resource_policy import apply_resource_policy
+
+SCREENSHOT_DIR = os.getenv("SCREENSHOT_DIR", "screenshots")
+# A page has finished redrawing once the canvas has gone this long without a draw call
+CANVAS_SETTLE_MS = 300
+CANVAS_REDRAW_TIMEOUT_MS = 10000
+
+CANVAS_SELECTOR = 'flipp-flyerview canvas'
+NEXT_PAGE_SELECTOR = "#app > flipp-flyer-page > flipp-page > div > main > div > div.experience-container > div.flyer-view-container > button.next-page"
+
+# Overlays that would otherwise end up in the capture
+REMOVE_OVERLAYS_JS = """
+() => [
+    '#app > flipp-flyer-page > flipp-page > download-app-banner > div',
+    'body > div.cky-consent-container.cky-box-bottom-left',
+    '#app > flipp-flyer-page > flipp-page > div > main > div > div.experience-container > div.flyer-view-container > div.zoom-buttons',
+    '#app > flipp-flyer-page > flipp-page > div > main > div > div.experience-container > div.flyer-view-container > a',
+].forEach(selector => document.querySelectorAll(selector).forEach(el => el.remove()))
+"""
+
+# Installed before any page script runs: counts canvas draw calls and when the last one
+# happened, so we can tell when the flyer view has finished painting
+TRACK_CANVAS_DRAWS_JS = """
+(() => {
+    window.__canvasDraws = 0;
+    window.__lastCanvasDraw = 0;
+    const track = (proto, names) => names.forEach(name => {
+        const original = proto && proto[name];
+        if (!original) return;
+        proto[name] = function (...args) {
+            window.__canvasDraws++;
+            window.__lastCanvasDraw = performance.now();
+            return original.apply(this, args);
+        };
+    });
+    track(window.CanvasRenderingContext2D && CanvasRenderingContext2D.prototype, ['drawImage', 'putImageData']);
+    track(window.WebGLRenderingContext && WebGLRenderingContext.prototype, ['drawArrays', 'drawElements']);
+    track(window.WebGL2RenderingContext && WebGL2RenderingContext.prototype, ['drawArrays', 'drawElements']);
+})();
+"""
+
+# True once there has been a draw since `since` and none for settleMs
+CANVAS_SETTLED_JS = """
+([since, settleMs]) => window.__canvasDraws > since && performance.now() - window.__lastCanvasDraw >= settleMs
+"""
+
+
+# Decode a captured page and append it to the output (started on the first page).
+# CPU-bound, so it runs on the executor rather than the worker's event loop.
+def add_page(writer, png, output_path):
+    with Image.open(io.BytesIO(png)) as image:
+        if writer is None:
+            writer = StreamingPNGWriter(output_path, image.width)
+        writer.add_strip(image)
+    return writer
+
+
+async def wait_for_redraw(page, draws_before):
+    try:
+        await page.wait_for_function(CANVAS_SETTLED_JS, arg=[draws_before, CANVAS_SETTLE_MS],
+                                     timeout=CANVAS_REDRAW_TIMEOUT_MS)
+    except Exception:
+        # Nothing to redraw (e.g. the page was already cached); capture what is shown
+        print("Canvas did not redraw in time, capturing the current frame.")
+
+
+# Capture every page of a flyer and stitch them into screenshots/<job_id>/flyer.png.
+# Pages are captured into memory one at a time and streamed into the PNG, so memory
+# does not grow with the number of pages.
+async def scrape_flyer_screenshot(url, job_id, context=None):
+    # Without a pooled context (e.g. when run as a script) launch a throwaway browser
+    if context is None:
+        async with launch_context() as context:
+            await apply_resource_policy(context, "screenshot")
+            return await scrape_flyer_screenshot(url, job_id, context)
+
+    output_dir = os.path.join(SCREENSHOT_DIR, job_id)
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, "flyer.png")
+
+    loop = asyncio.get_running_loop()
+    page = await context.new_page()
+    await page.add_init_script(TRACK_CANVAS_DRAWS_JS)
+    try:
+        print(f"Navigating to {url}")
+        with span("screenshot", "goto"):
+            await page.goto(url, wait_until='domcontentloaded')
+            canvas = await page.wait_for_selector(CANVAS_SELECTOR, state='visible', timeout=60000)
+            await wait_for_redraw(page, 0)
+        await page.evaluate(REMOVE_OVERLAYS_JS)
+
+        canvas_box = await canvas.bounding_box()
+        if not canvas_box:
+            raise Exception("Failed to retrieve bounding box of canvas")
+
+        pages = 0
+        writer = None
+        try:
+            while True:
+                with span("screenshot", "capture"):
+                    png = await page.screenshot(clip=canvas_box)
+                with span("screenshot", "encode"):
+                    writer = await loop.run_in_executor(None, add_page, writer, png, output_path)
+                pages += 1
+
+                button = await page.query_selector(NEXT_PAGE_SELECTOR)
+                if not button or await button.is_disabled():
+                    print("Reached the end of the flyer.")
+                    break
+
+                draws_before = await page.evaluate("window.__canvasDraws")
+                with span("screenshot", "next_page"):
+                    await button.click()
+                    await wait_for_redraw(page, draws_before)
+        finally:
+            if writer is not None:
+                await loop.run_in_executor(None, writer.close)
+    finally:
+        await page.close()
+
+    print(f"Stitched {pages} pages into {output_path}")
+    return {"path": output_path, "pages": pages, "width": writer.width, "height": writer.height}
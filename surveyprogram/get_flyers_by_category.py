@@ -1,70 +1,145 @@
 import asyncio
-from playwright.async_api import async_playwright
 import json
+from browser_pool import launch_context
+from flipp_site import FLIPP_BASE_URL
+from metrics import span
+from resource_policy import apply_resource_policy
+from scroll import scroll_to_end
+from flyer_delta import KnownRunStop
+
+# Runs in the page: returns [name, valid_until, image src, link href] per listing,
+# null where an element or attribute is missing
+EXTRACT_FLYERS_JS = """
+flyers => flyers.map(flyer => {
+    const text = selector => {
+        const element = flyer.querySelector(selector);
+        return element ? element.innerText : null;
+    };
+    const attribute = (selector, name) => {
+        const element = flyer.querySelector(selector);
+        return element ? element.getAttribute(name) : null;
+    };
+    return [
+        text('p.flyer-name'),
+        text('div.flyer-info-block p:nth-of-type(2)'),
+        attribute('img.flyer-thumbnail', 'src'),
+        attribute('a.flyer-container, a.premium-flyer-container', 'href'),
+    ];
+})
+"""
+
+# Resolves once the listing has gone quiet_ms without DOM mutations, i.e. the sort
+# click has finished re-rendering it. Unlike 'networkidle' this ignores background traffic.
+# A page that never goes quiet (carousel, lazy-image churn) resolves after maxMs anyway.
+WAIT_FOR_QUIET_JS = """
+([selector, quietMs, maxMs]) => new Promise(resolve => {
+    const root = document.querySelector(selector) || document.body;
+    let timer = setTimeout(done, quietMs);
+    const deadline = setTimeout(done, maxMs);
+    const observer = new MutationObserver(() => {
+        clearTimeout(timer);
+        timer = setTimeout(done, quietMs);
+    });
+    function done() {
+        observer.disconnect();
+        clearTimeout(timer);
+        clearTimeout(deadline);
+        resolve();
+    }
+    observer.observe(root, {childList: true, subtree: true, attributes: true});
+})
+"""
+
+# Same fields, only for the listings from index start on
+EXTRACT_FLYERS_FROM_JS = f"(flyers, start) => ({EXTRACT_FLYERS_JS.strip()})(flyers.slice(start))"
+
+LISTING_SELECTOR = 'div.content flipp-flyer-listing-item'
+LISTING_QUIET_MS = 500
+LISTING_QUIET_MAX_MS = 5000
+SORTING_OPTIONS = ['featured', 'latest', 'alphabetical']
+
+
+def listing_from_row(row):
+    name_text, valid_until_text, img_src, flyer_link = row
+    name_text = name_text if name_text is not None else 'Unknown'
+    valid_until_text = valid_until_text if valid_until_text is not None else 'Unknown'
+
+    return {
+        "name": name_text.strip(),
+        "valid_until": valid_until_text.strip(),
+        "image_url": img_src,
+        "source_link": FLIPP_BASE_URL + flyer_link if flyer_link else None
+    }
+
+
+# The listings rendered from index start on, for incremental refreshes
+async def extract_listings_from(page, start):
+    rows = await page.eval_on_selector_all(LISTING_SELECTOR, EXTRACT_FLYERS_FROM_JS, start)
+    return [listing_from_row(row) for row in rows]
+
+
+def category_url(category, postal_code):
+    if category.lower() == "all flyers":
+        return f"{FLIPP_BASE_URL}/en-ca/flyers?postal_code={postal_code}"
+    return f"{FLIPP_BASE_URL}/en-ca/flyers/{category.lower()}?postal_code={postal_code}"
+
+
+# Load the listing in its own page, switch to one sort order and extract every flyer
+# (or, with should_stop, every flyer up to where scrolling stopped)
+async def scrape_sort_option(context, url, option, should_stop=None):
+    page = await context.new_page()
+    try:
+        with span("category", "goto"):
+            await page.goto(url, wait_until='domcontentloaded')
+            await page.wait_for_selector(LISTING_SELECTOR, state='attached', timeout=15000)
+
+        print(f"Clicking on '{option}' sorting button")
+        with span("category", "sort"):
+            await page.click(f'button[sort="{option}"]')
+            await page.evaluate(WAIT_FOR_QUIET_JS, ['div.content', LISTING_QUIET_MS, LISTING_QUIET_MAX_MS])
+        with span("category", "scroll"):
+            scroll_stats = await scroll_to_end(page, should_stop=should_stop)
+        print(f"Scrolled '{option}' listing: {scroll_stats}")
+        
+        await page.wait_for_selector('div.content', state='visible', timeout=15000)
+
+        # Pull every listing's fields in a single round trip
+        with span("category", "extract"):
+            flyers = await page.eval_on_selector_all(LISTING_SELECTOR, EXTRACT_FLYERS_JS)
+        if not flyers:
+            print(f"Error: No flyers found for option '{option}'.")
+            return []
+
+        return [listing_from_row(row) for row in flyers]
+    finally:
+        await page.close()
+
+# options limits the scrape to some sort orders, e.g. those the JSON API can't serve
+async def scrape_flyers_by_category(category, postal_code, context=None, options=SORTING_OPTIONS):
+    # Without a pooled context (e.g. when run as a script) launch a throwaway browser
+    if context is None:
+        async with launch_context() as context:
+            await apply_resource_policy(context, "category")
+            return await scrape_flyers_by_category(category, postal_code, context, options)
+
+    url = category_url(category, postal_code)
+
+    # Each sort order gets a sibling page in the same context, so the three passes
+    # (load, sort click, scroll, extract) overlap instead of running back to back
+    flyers_per_option = await asyncio.gather(*(scrape_sort_option(context, url, option) for option in options))
+    result = dict(zip(options, flyers_per_option))
 
-async def scroll_to_end(page):
-    last_height = await page.evaluate("document.body.scrollHeight")
-    while True:
-        await page.evaluate("window.scrollTo(0, document.body.scrollHeight);")
-        await page.wait_for_timeout(1000)
-
-        new_height = await page.evaluate("document.body.scrollHeight")
-        if new_height == last_height:
-            break
-        last_height = new_height
-
-async def scrape_flyers_by_category(category, postal_code):
-    url = f"https://flipp.com/en-ca/flyers?postal_code={postal_code}" if category.lower() == "all flyers" else f"https://flipp.com/en-ca/flyers/{category.lower()}?postal_code={postal_code}"
-
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        page = await browser.new_page()
-
-        await page.goto(url)
-        await page.wait_for_load_state('networkidle')
+    return result  # Return dictionary instead of JSON-encoded string
 
-        sorting_options = ['featured', 'latest', 'alphabetical']
-        result = {}
 
-        for option in sorting_options:
-            print(f"Clicking on '{option}' sorting button")
-            await page.click(f'button[sort="{option}"]')
-            await page.wait_for_load_state('networkidle')
-            await scroll_to_end(page)
-            
-            await page.wait_for_selector('div.content', state='visible', timeout=15000)
-
-            flyers = await page.query_selector_all('div.content flipp-flyer-listing-item')
-            if not flyers:
-                print(f"Error: No flyers found for option '{option}'.")
-                result[option] = []
-                continue
-
-            flyers_data = []
-            for flyer in flyers:
-                name_element = await flyer.query_selector('p.flyer-name')
-                validity_element = await flyer.query_selector('div.flyer-info-block p:nth-of-type(2)')
-                img_element = await flyer.query_selector('img.flyer-thumbnail')
-                link_element = await flyer.query_selector('a.flyer-container, a.premium-flyer-container')
-
-                name_text = await name_element.inner_text() if name_element else 'Unknown'
-                valid_until_text = await validity_element.inner_text() if validity_element else 'Unknown'
-                img_src = await img_element.get_attribute('src') if img_element else None
-                flyer_link = await link_element.get_attribute('href') if link_element else None
-
-                flyer_info = {
-                    "name": name_text.strip(),
-                    "valid_until": valid_until_text.strip(),
-                    "image_url": img_src,
-                    "source_link": "https://flipp.com" + flyer_link if flyer_link else None
-                }
-                flyers_data.append(flyer_info)
-
-            result[option] = flyers_data
-
-        await browser.close()
+# Refresh a category from its 'latest' order only, scrolling until a run of flyers the
+# caller already knows (flyer id -> fingerprint). Returns the scraped prefix, ending
+# with that run, and whether scrolling stopped early.
+async def scrape_latest_until_known(category, postal_code, known, context):
+    stop = KnownRunStop(known, extract_listings_from)
+    listings = await scrape_sort_option(context, category_url(category, postal_code), 'latest', should_stop=stop)
+    return (listings[:stop.end], True) if stop.stopped else (listings, False)
 
-    return result  # Return dictionary instead of JSON-encoded string
 
 # For testing outside of Flask
 category = "Groceries"
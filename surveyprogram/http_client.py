@@ -0,0 +1,40 @@
+import os
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from rate_limit import FLIPP_DOMAINS, flipp_bucket
+from resource_policy import domain_matches
+
+# Outbound HTTP settings shared by every API call the worker makes
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+# Connections kept per host: by default one for every flyer fetch a worker can run at
+# once (fast jobs at a time x flyers fetched per batch job)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", str(
+    int(os.getenv("FAST_CONCURRENCY", "8")) * int(os.getenv("FLYER_FETCH_CONCURRENCY", "8")))))
+
+# Retry throttling and server errors with exponential backoff (0.5 s, 1 s, 2 s, ...),
+# honouring Retry-After on 429s
+retry = Retry(
+    total=HTTP_RETRIES,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["GET"]),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+# Keep-alive connection pool, so repeated calls reuse TLS connections. Blocking makes
+# callers beyond the pool size wait for a free connection instead of opening throwaway ones.
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=10, pool_maxsize=HTTP_POOL_SIZE, pool_block=True, max_retries=retry)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+
+
+def get(url, **kwargs):
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    if domain_matches(urlparse(url).hostname or "", FLIPP_DOMAINS):
+        flipp_bucket.acquire()
+    return session.get(url, **kwargs)
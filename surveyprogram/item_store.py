@@ -0,0 +1,272 @@
+import os
+import re
+import math
+import time
+import queue
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+
+# Flyer items from finished jobs, indexed for /items/search so price and text queries
+# are answered locally instead of by re-scraping. Worker processes write, the API reads.
+ITEM_DB_PATH = os.getenv("ITEM_DB_PATH", os.path.join("data", "items.db"))
+ITEM_DB_BUSY_TIMEOUT_MS = int(os.getenv("ITEM_DB_BUSY_TIMEOUT_MS", "5000"))
+ITEM_DB_POOL_SIZE = 8
+
+# Items are written in batches: up to ITEM_BATCH_SIZE per transaction, and at most
+# ITEM_FLUSH_SECONDS after a job finishes
+ITEM_BATCH_SIZE = int(os.getenv("ITEM_BATCH_SIZE", "1000"))
+ITEM_FLUSH_SECONDS = float(os.getenv("ITEM_FLUSH_SECONDS", "1"))
+
+SEARCH_PAGE_LIMIT = 50
+SEARCH_MAX_LIMIT = 500
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS items (
+        id INTEGER PRIMARY KEY,
+        flyer_id INTEGER,
+        name TEXT,
+        brand TEXT,
+        price REAL,
+        price_text TEXT,
+        valid_from TEXT,
+        valid_to TEXT,
+        -- Validity window as Unix times, comparable across time zones
+        valid_from_ts REAL,
+        valid_to_ts REAL,
+        cutout_image_url TEXT,
+        updated_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_items_price ON items (price);
+    CREATE INDEX IF NOT EXISTS idx_items_brand ON items (brand COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS idx_items_valid ON items (valid_to_ts, valid_from_ts);
+    CREATE INDEX IF NOT EXISTS idx_items_flyer ON items (flyer_id);
+
+    -- A flyer is served to many postal codes; one row per pair seen
+    CREATE TABLE IF NOT EXISTS flyer_postal_codes (
+        postal_code TEXT NOT NULL,
+        flyer_id INTEGER NOT NULL,
+        PRIMARY KEY (postal_code, flyer_id)
+    ) WITHOUT ROWID;
+
+    -- Full-text index over name and brand, kept in step with items by triggers
+    CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+        name, brand, content='items', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    );
+    CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items
+    BEGIN
+        INSERT INTO items_fts (rowid, name, brand) VALUES (NEW.id, NEW.name, NEW.brand);
+    END;
+    CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF name, brand ON items
+    WHEN OLD.name IS NOT NEW.name OR OLD.brand IS NOT NEW.brand
+    BEGIN
+        INSERT INTO items_fts (items_fts, rowid, name, brand) VALUES ('delete', OLD.id, OLD.name, OLD.brand);
+        INSERT INTO items_fts (rowid, name, brand) VALUES (NEW.id, NEW.name, NEW.brand);
+    END;
+    CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items
+    BEGIN
+        INSERT INTO items_fts (items_fts, rowid, name, brand) VALUES ('delete', OLD.id, OLD.name, OLD.brand);
+    END;
+'''
+
+UPSERT_ITEM = '''
+    INSERT INTO items (id, flyer_id, name, brand, price, price_text, valid_from, valid_to,
+                       valid_from_ts, valid_to_ts, cutout_image_url, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET
+        flyer_id = excluded.flyer_id, name = excluded.name, brand = excluded.brand,
+        price = excluded.price, price_text = excluded.price_text,
+        valid_from = excluded.valid_from, valid_to = excluded.valid_to,
+        valid_from_ts = excluded.valid_from_ts, valid_to_ts = excluded.valid_to_ts,
+        cutout_image_url = excluded.cutout_image_url, updated_at = excluded.updated_at
+'''
+
+ITEM_COLUMNS = ("id", "flyer_id", "name", "brand", "price", "price_text", "valid_from", "valid_to", "cutout_image_url")
+
+
+def parse_price(price):
+    # Flyer prices are strings such as "2.99"; multi-buy text like "2/$5" has no unit price
+    try:
+        return float(str(price).replace("$", "").replace(",", "").strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_time(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def postal_code_from_url(url):
+    values = parse_qs(urlparse(url).query).get("postal_code")
+    return re.sub(r"\s+", "", values[0]).upper() if values else None
+
+
+def item_row(item, now):
+    return (
+        item["id"], item.get("sku"), item.get("name"), item.get("brand"),
+        parse_price(item.get("price")), item.get("price"), item.get("valid_from"), item.get("valid_to"),
+        parse_time(item.get("valid_from")), parse_time(item.get("valid_to")), item.get("cutout_image_url"), now,
+    )
+
+
+# Every (flyer url, items) pair in a finished job's result
+def flyers_in_result(task, result):
+    if task["type"] == "url" and isinstance(result, list):
+        return [(task["url"], result)]
+    if task["type"] == "urls" and isinstance(result, dict):
+        return [(url, items) for url, items in result.items() if isinstance(items, list)]
+    if task["type"] == "category_delta" and isinstance(result, dict):
+        return [(url, items) for url, items in result.get("items", {}).items() if isinstance(items, list)]
+    return []
+
+
+# Keyset cursor over (price, id); items without a unit price sort last
+def encode_cursor(price, item_id):
+    return f"{'' if price is None else repr(price)}:{item_id}"
+
+
+# Raises ValueError for anything encode_cursor couldn't have produced
+def decode_cursor(cursor):
+    price, item_id = cursor.rsplit(":", 1)
+    price = float(price) if price else None
+    if price is not None and not math.isfinite(price):
+        raise ValueError(f"Invalid cursor price: {price}")
+    return price, int(item_id)
+
+
+# FTS5 query matching every word of the search text as a prefix
+def match_query(text):
+    words = re.findall(r"\w+", text.lower())
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class ItemStore:
+    def __init__(self, db_path=ITEM_DB_PATH):
+        self.db_path = db_path
+        self._pool = queue.LifoQueue()
+        self._pending = queue.Queue()
+        self._writer = None
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                               timeout=ITEM_DB_BUSY_TIMEOUT_MS / 1000)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={ITEM_DB_BUSY_TIMEOUT_MS}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._pool.qsize() < ITEM_DB_POOL_SIZE:
+                self._pool.put(conn)
+            else:
+                conn.close()
+
+    def init_db(self):
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    # One transaction for a whole batch of (postal code, items) pairs
+    def upsert(self, batch):
+        now = time.time()
+        rows = {}
+        flyer_postal_codes = set()
+        for postal_code, items in batch:
+            for item in items:
+                rows[item["id"]] = item_row(item, now)
+                if postal_code and item.get("sku") is not None:
+                    flyer_postal_codes.add((postal_code, item["sku"]))
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(UPSERT_ITEM, rows.values())
+            conn.executemany("INSERT OR IGNORE INTO flyer_postal_codes (postal_code, flyer_id) VALUES (?, ?)", flyer_postal_codes)
+            conn.execute("COMMIT")
+        return len(rows)
+
+    # Queue a finished job's items for the background writer
+    def add_result(self, task, result):
+        for url, items in flyers_in_result(task, result):
+            if items:
+                self._pending.put((postal_code_from_url(url), items))
+
+    def _write_batches(self):
+        while True:
+            batch = [self._pending.get()]
+            size = len(batch[0][1])
+            deadline = time.monotonic() + ITEM_FLUSH_SECONDS
+            while size < ITEM_BATCH_SIZE:
+                try:
+                    batch.append(self._pending.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+                size += len(batch[-1][1])
+            try:
+                written = self.upsert(batch)
+                logging.info("Indexed %s flyer items.", written)
+            except sqlite3.Error as e:
+                logging.error("Could not index %s flyer items: %s", size, e)
+
+    def start_writer(self):
+        self.init_db()
+        self._writer = threading.Thread(target=self._write_batches, name="item-writer", daemon=True)
+        self._writer.start()
+
+    # Keyset-paginated search, cheapest first. Returns (items, next cursor or None).
+    def search(self, text=None, min_price=None, max_price=None, brand=None, postal_code=None,
+               valid_at=None, limit=SEARCH_PAGE_LIMIT, cursor=None):
+        conditions, params = [], []
+        source = "items"
+        if text and match_query(text):
+            source = "items JOIN items_fts ON items_fts.rowid = items.id"
+            conditions.append("items_fts MATCH ?")
+            params.append(match_query(text))
+        if min_price is not None:
+            conditions.append("items.price >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            conditions.append("items.price <= ?")
+            params.append(max_price)
+        if brand:
+            conditions.append("items.brand = ? COLLATE NOCASE")
+            params.append(brand)
+        if postal_code:
+            # Any postal code starting with the given prefix, e.g. an FSA
+            conditions.append("items.flyer_id IN (SELECT flyer_id FROM flyer_postal_codes WHERE postal_code GLOB ?)")
+            params.append(re.sub(r"[^A-Z0-9]", "", postal_code.upper()) + "*")
+        if valid_at is not None:
+            conditions.append("items.valid_to_ts >= ? AND (items.valid_from_ts IS NULL OR items.valid_from_ts <= ?)")
+            params.extend([valid_at, valid_at])
+        if cursor:
+            price, item_id = decode_cursor(cursor)
+            if price is None:
+                conditions.append("items.price IS NULL AND items.id > ?")
+                params.append(item_id)
+            else:
+                conditions.append("(items.price > ? OR (items.price = ? AND items.id > ?) OR items.price IS NULL)")
+                params.extend([price, price, item_id])
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        columns = ", ".join(f"items.{column}" for column in ITEM_COLUMNS)
+        query = f"SELECT {columns} FROM {source} {where} ORDER BY items.price IS NULL, items.price, items.id LIMIT ?"
+        with self.connection() as conn:
+            rows = conn.execute(query, params + [limit]).fetchall()
+
+        items = [dict(zip(ITEM_COLUMNS, row)) for row in rows]
+        next_cursor = encode_cursor(items[-1]["price"], items[-1]["id"]) if len(items) == limit else None
+        return items, next_cursor
@@ -0,0 +1,53 @@
+import json
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from job_store import EVENTS_CHANNEL
+
+RESUBSCRIBE_DELAY = 1.0
+
+
+# Fans job status events out to waiting requests. A single pub/sub connection
+# subscribes to every job channel, so open SSE streams and long polls don't each
+# hold a Redis connection or poll job records.
+class JobEventHub:
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self._waiters = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._listen, name="job-events", daemon=True).start()
+
+    def _listen(self):
+        prefix = EVENTS_CHANNEL.format(job_id="")
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(EVENTS_CHANNEL.format(job_id="*"))
+                for message in pubsub.listen():
+                    job_id = message["channel"].decode()[len(prefix):]
+                    with self._lock:
+                        waiters = list(self._waiters.get(job_id, ()))
+                    if waiters:
+                        event = json.loads(message["data"])
+                        for waiter in waiters:
+                            waiter.put_nowait(event)
+            except Exception as e:
+                logging.warning("Job event subscription lost, resubscribing: %r", e)
+                time.sleep(RESUBSCRIBE_DELAY)
+
+    # Register interest in a job's events; subscribe before reading the current status
+    # so no transition can slip between the read and the wait
+    @contextmanager
+    def watch(self, job_id):
+        waiter = queue.Queue()
+        with self._lock:
+            self._waiters.setdefault(job_id, set()).add(waiter)
+        try:
+            yield waiter
+        finally:
+            with self._lock:
+                self._waiters[job_id].discard(waiter)
+                if not self._waiters[job_id]:
+                    del self._waiters[job_id]
@@ -0,0 +1,173 @@
+import os
+import json
+import zlib
+
+# Items per stored result chunk; a paginated status poll only inflates the chunks it needs
+RESULT_CHUNK_SIZE = int(os.getenv("RESULT_CHUNK_SIZE", "500"))
+
+# How long a job record lives in each state. In-progress records must outlive the
+# cache's in-flight claim, and completed ones (with their results) are kept at least as
+# long as the cache entry pointing at them.
+JOB_TTLS = {
+    "pending": int(os.getenv("JOB_TTL_PENDING", str(24 * 3600))),
+    "in_progress": int(os.getenv("JOB_TTL_IN_PROGRESS", str(6 * 3600))),
+    "completed": int(os.getenv("JOB_TTL_COMPLETED", str(24 * 3600))),
+    "failed": int(os.getenv("JOB_TTL_FAILED", str(24 * 3600))),
+}
+
+# Job records are hashes, so a transition only writes the fields it changes
+JOB_KEY = "job:{job_id}"
+RESULT_KEY = "result:{job_id}"
+# Pub/sub channel carrying every status transition of a job
+EVENTS_CHANNEL = "job:{job_id}"
+TERMINAL_STATUSES = ("completed", "failed")
+
+INT_FIELDS = ("item_count", "chunk_size", "postal_codes_total", "markets_total", "markets_done", "markets_failed")
+TIME_FIELDS = ("enqueued_at", "started_at", "finished_at")
+
+# Recent (queue, run) latencies per job type, for /jobs/stats
+TIMINGS_KEY = "jobs:timings:{job_type}"
+TIMING_SAMPLES = 1000
+
+
+# Results are stored as compact JSON (no whitespace) under zlib
+def encode(value):
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode(), 6)
+
+
+def decode(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+# Apply a status transition in one round trip: update the record's fields, reset its
+# TTL for the new state (and its result's, once completed), record the job's latencies
+# when it finishes, and announce the transition.
+# timing is (job type, queue seconds, run seconds).
+def set_status(redis_client, job_id, status, ttl=None, timing=None, **fields):
+    job_data = {"status": status, **fields}
+    ttl = ttl or JOB_TTLS[status]
+    key = JOB_KEY.format(job_id=job_id)
+
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(key, mapping={name: value for name, value in job_data.items() if value is not None})
+    pipe.expire(key, ttl)
+    if status == "completed":
+        pipe.expire(RESULT_KEY.format(job_id=job_id), ttl)
+    if timing is not None:
+        job_type, queue_seconds, run_seconds = timing
+        timings_key = TIMINGS_KEY.format(job_type=job_type)
+        pipe.lpush(timings_key, json.dumps([round(queue_seconds * 1000), round(run_seconds * 1000)]))
+        pipe.ltrim(timings_key, 0, TIMING_SAMPLES - 1)
+    pipe.publish(EVENTS_CHANNEL.format(job_id=job_id), json.dumps(job_data))
+    pipe.execute()
+
+
+def get_status(redis_client, job_id):
+    job_data = redis_client.hgetall(JOB_KEY.format(job_id=job_id))
+    if not job_data:
+        return None
+    job_data = {name.decode(): value.decode() for name, value in job_data.items()}
+    for name in INT_FIELDS:
+        if name in job_data:
+            job_data[name] = int(job_data[name])
+    for name in TIME_FIELDS:
+        if name in job_data:
+            job_data[name] = float(job_data[name])
+    return job_data
+
+
+# Just the status, for callers that don't need the whole record
+def get_state(redis_client, job_id):
+    status = redis_client.hget(JOB_KEY.format(job_id=job_id), "status")
+    return status.decode() if status is not None else None
+
+
+# Statuses of many jobs in one round trip, None for records that have expired
+def get_states(redis_client, job_ids):
+    pipe = redis_client.pipeline(transaction=False)
+    for job_id in job_ids:
+        pipe.hget(JOB_KEY.format(job_id=job_id), "status")
+    return [status.decode() if status is not None else None for status in pipe.execute()]
+
+
+def exists(redis_client, job_id):
+    return bool(redis_client.exists(JOB_KEY.format(job_id=job_id)))
+
+
+def delete(redis_client, job_id):
+    redis_client.delete(JOB_KEY.format(job_id=job_id), RESULT_KEY.format(job_id=job_id))
+
+
+def is_item_list(result):
+    return isinstance(result, list) and bool(result) and all(isinstance(item, dict) for item in result)
+
+
+# Store a result next to its job record and return the metadata describing it.
+# Lists of dicts (flyer items, categories) are stored column-wise in chunks of
+# RESULT_CHUNK_SIZE rows so they can be paged; anything else is one blob.
+def save_result(redis_client, job_id, result):
+    key = RESULT_KEY.format(job_id=job_id)
+    pipe = redis_client.pipeline()
+    pipe.delete(key)
+
+    if is_item_list(result):
+        fields = list(dict.fromkeys(field for item in result for field in item))
+        for start in range(0, len(result), RESULT_CHUNK_SIZE):
+            rows = [[item.get(field) for field in fields] for item in result[start:start + RESULT_CHUNK_SIZE]]
+            pipe.rpush(key, encode({"fields": fields, "rows": rows}))
+        meta = {"result_format": "items", "item_count": len(result), "chunk_size": RESULT_CHUNK_SIZE}
+    else:
+        pipe.rpush(key, encode(result))
+        meta = {"result_format": "value"}
+    # Lives as long as a running job until the completed transition extends it
+    pipe.expire(key, JOB_TTLS["in_progress"])
+
+    pipe.execute()
+    return {**meta, "result_key": key}
+
+
+# Load a stored result, or just the [offset, offset + limit) slice of an item list
+def load_result(redis_client, job_id, job_data, offset=0, limit=None):
+    key = job_data.get("result_key", RESULT_KEY.format(job_id=job_id))
+    if job_data.get("result_format") != "items":
+        blob = redis_client.lindex(key, 0)
+        return decode(blob) if blob is not None else None
+
+    chunk_size = job_data["chunk_size"]
+    end = job_data["item_count"] if limit is None else min(offset + limit, job_data["item_count"])
+    if offset >= end:
+        return []
+
+    items = []
+    first_chunk = offset // chunk_size
+    for blob in redis_client.lrange(key, first_chunk, (end - 1) // chunk_size):
+        chunk = decode(blob)
+        items.extend(dict(zip(chunk["fields"], row)) for row in chunk["rows"])
+    skip = offset - first_chunk * chunk_size
+    return items[skip:skip + (end - offset)]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# p50/p95 queue and run latency (ms) over the recent jobs of each type
+def get_timing_stats(redis_client, job_types):
+    pipe = redis_client.pipeline(transaction=False)
+    for job_type in job_types:
+        pipe.lrange(TIMINGS_KEY.format(job_type=job_type), 0, -1)
+
+    stats = {}
+    for job_type, samples in zip(job_types, pipe.execute()):
+        samples = [json.loads(sample) for sample in samples]
+        queue_ms = [sample[0] for sample in samples]
+        run_ms = [sample[1] for sample in samples]
+        stats[job_type] = {
+            "samples": len(samples),
+            "queue_ms": {"p50": percentile(queue_ms, 0.5), "p95": percentile(queue_ms, 0.95)},
+            "run_ms": {"p50": percentile(run_ms, 0.5), "p95": percentile(run_ms, 0.95)},
+        }
+    return stats
@@ -0,0 +1,129 @@
+import os
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Log pipeline tuning: records buffered between request threads and the writer thread,
+# rotation by size and age, and how often buffered lines are flushed to disk
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_SECONDS = int(os.getenv("LOG_ROTATE_SECONDS", str(24 * 3600)))
+LOG_FLUSH_RECORDS = 200
+LOG_FLUSH_SECONDS = 1.0
+
+
+# One JSON object per line
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+# Rotates on size or age, and writes to disk in batches: after LOG_FLUSH_RECORDS
+# records, or every LOG_FLUSH_SECONDS when the log is quiet
+class BufferedRotatingFileHandler(RotatingFileHandler):
+    def __init__(self, filename):
+        super().__init__(filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+        self.rollover_at = time.time() + LOG_ROTATE_SECONDS
+        self.pending = 0
+        threading.Thread(target=self._flush_periodically, daemon=True).start()
+
+    def shouldRollover(self, record):
+        if LOG_ROTATE_SECONDS and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + LOG_ROTATE_SECONDS
+
+    # emit() calls this after every record; only hit the disk once a batch is ready
+    def flush(self):
+        self.pending += 1
+        if self.pending >= LOG_FLUSH_RECORDS:
+            self.flush_now()
+
+    def flush_now(self):
+        with self.lock:
+            if self.stream:
+                self.stream.flush()
+            self.pending = 0
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(LOG_FLUSH_SECONDS)
+            if self.pending:
+                self.flush_now()
+
+    def close(self):
+        self.flush_now()
+        super().close()
+
+
+# Never blocks the caller: when the writer falls behind, records are dropped and counted
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # The stock prepare() renders the traceback into the message and clears exc_info.
+    # The listener runs in this process, so the record keeps exc_info for the writer's
+    # formatters to render (JSON puts it in its own field); only the message args are merged.
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+queue_handler = None
+
+
+# Route all logging through a bounded queue to a single writer thread, so request
+# threads never wait on disk I/O
+def setup_logging(log_dir, filename="app.log", console=False, level=logging.INFO):
+    global queue_handler
+    os.makedirs(log_dir, exist_ok=True)
+
+    file_handler = BufferedRotatingFileHandler(os.path.join(log_dir, filename))
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+        handlers.append(console_handler)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [queue_handler]
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def log_stats():
+    if queue_handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": queue_handler.queue.qsize(), "dropped": queue_handler.dropped}
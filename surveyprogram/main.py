@@ -1,10 +1,22 @@
 import os
 import uuid
+import hmac
 import json
+import queue
+import time
 import logging
-from flask import Flask, request, jsonify
-import pika
+from flask import Flask, request, jsonify, Response, stream_with_context, send_from_directory, g
 import redis
+import job_store
+import scheduler
+import markets
+from job_events import JobEventHub
+from publisher import Publisher, PublishError
+from api_keys import ApiKeyIndex
+from item_store import ItemStore, SEARCH_PAGE_LIMIT, SEARCH_MAX_LIMIT, decode_cursor
+from logging_setup import setup_logging, log_stats
+from metrics import REGISTRY, CONTENT_TYPE, QUEUE_DEPTH, Counter, Histogram
+import result_cache
 
 from dotenv import load_dotenv
 
@@ -15,32 +27,99 @@ app = Flask(__name__)
 
 # Setup logging
 log_directory = "logs"
-os.makedirs(log_directory, exist_ok=True)
-logging.basicConfig(
-    filename=os.path.join(log_directory, "app.log"),
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+setup_logging(log_directory)
 
 # Redis setup for job status
 redis_client = redis.StrictRedis(host="localhost", port=6379, db=0)
 
-# RabbitMQ setup
+# RabbitMQ setup: request threads hand tasks to the publisher's own connections
 rabbitmq_host = os.getenv("RABBITMQ_HOST", "localhost")
-connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host))
-channel = connection.channel()
-channel.queue_declare(queue="task_queue", durable=True)
+publisher = Publisher(rabbitmq_host, queues=tuple(scheduler.QUEUES.values()))
 
-# API Key for securing routes
-API_KEY = os.getenv("API_KEY", "default_api_key")
+# Job status transitions pushed over Redis pub/sub, for /job/events and /job/wait
+job_events = JobEventHub(redis_client)
+
+# Per-user API keys minted by userManage, kept in memory for constant-cost lookups
+api_key_index = ApiKeyIndex()
+api_key_index.start()
+
+# Where workers write screenshot jobs' PNGs; /screenshot/<job_id> serves them when the
+# API shares this directory with the workers (same host or a shared volume)
+SCREENSHOT_DIR = os.getenv("SCREENSHOT_DIR", "screenshots")
+
+# Flyer items indexed by the workers, searched by /items/search without scraping
+item_store = ItemStore()
+item_store.init_db()
+
+# Optional service-wide API key, accepted alongside the per-user keys
+API_KEY = os.getenv("API_KEY")
+
+# Largest flyer batch accepted by /scrape/urls
+MAX_BATCH_URLS = int(os.getenv("MAX_BATCH_URLS", "500"))
+# Largest postal code list accepted by /scrape/sweep, and the jobs a sweep can run
+MAX_SWEEP_POSTAL_CODES = int(os.getenv("MAX_SWEEP_POSTAL_CODES", "1000"))
+SWEEP_JOBS = ("categories", "category")
+
+# How long an event stream or long poll stays open, and the SSE keepalive interval
+JOB_EVENTS_MAX_SECONDS = int(os.getenv("JOB_EVENTS_MAX_SECONDS", "600"))
+JOB_WAIT_MAX_SECONDS = int(os.getenv("JOB_WAIT_MAX_SECONDS", "60"))
+SSE_KEEPALIVE_SECONDS = 15
+
+REQUEST_SECONDS = Histogram("api_request_seconds", "API request handling time.", ["endpoint", "method", "status"])
+JOBS_ENQUEUED = Counter("api_jobs_enqueued", "Scrape requests by job type and cache outcome.", ["job_type", "outcome"])
+PUBLISH_FAILURES = Counter("api_publish_failures", "Jobs that could not be queued.", ["job_type"])
+
+
+def collect_queue_depths():
+    depths = publisher.queue_depths(timeout=2)
+    for name, queue_name in scheduler.QUEUES.items():
+        if depths.get(queue_name) is not None:
+            QUEUE_DEPTH.set(depths[queue_name], job_class=name)
+
+
+REGISTRY.on_collect(collect_queue_depths)
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    # Label by route pattern, not path, so job ids don't each get their own series
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=endpoint,
+                            method=request.method, status=response.status_code)
+    return response
 
 
 # Utility to validate API key
 def validate_api_key():
     api_key = request.headers.get("X-API-Key")
-    if api_key != API_KEY:
+    if not api_key:
         return False
-    return True
+    if API_KEY and hmac.compare_digest(api_key.encode(), API_KEY.encode()):
+        return True
+    return api_key_index.lookup(api_key) is not None
+
+
+# Returns the job id to hand back and the cache outcome, see scheduler.enqueue()
+def enqueue_task(task_data):
+    try:
+        job_id, outcome = scheduler.enqueue(redis_client, publisher, task_data)
+    except PublishError:
+        JOBS_ENQUEUED.inc(job_type=task_data["type"], outcome="miss")
+        PUBLISH_FAILURES.inc(job_type=task_data["type"])
+        raise
+    JOBS_ENQUEUED.inc(job_type=task_data["type"], outcome=outcome)
+    return job_id, outcome
+
+
+@app.errorhandler(PublishError)
+def publish_failed(e):
+    logging.error("%s", e)
+    return jsonify({"error": "Job queue unavailable, try again later."}), 503
 
 
 @app.route('/scrape/categories', methods=['POST'])
@@ -55,14 +134,8 @@ def scrape_categories():
 
     job_id = str(uuid.uuid4())
     task_data = {"type": "categories", "postal_code": postal_code, "job_id": job_id}
-    channel.basic_publish(
-        exchange="",
-        routing_key="task_queue",
-        body=json.dumps(task_data),
-        properties=pika.BasicProperties(delivery_mode=2)  # Make message persistent
-    )
-    redis_client.set(job_id, json.dumps({"status": "pending"}))
-    logging.info(f"Job {job_id} added for scrape_categories with postal code {postal_code}")
+    job_id, outcome = enqueue_task(task_data)
+    logging.info("Job %s added for scrape_categories with postal code %s (cache %s)", job_id, postal_code, outcome)
     return jsonify({"job_id": job_id})
 
 
@@ -78,14 +151,44 @@ def scrape_url():
 
     job_id = str(uuid.uuid4())
     task_data = {"type": "url", "url": url, "job_id": job_id}
-    channel.basic_publish(
-        exchange="",
-        routing_key="task_queue",
-        body=json.dumps(task_data),
-        properties=pika.BasicProperties(delivery_mode=2)
-    )
-    redis_client.set(job_id, json.dumps({"status": "pending"}))
-    logging.info(f"Job {job_id} added for scrape_url with URL {url}")
+    job_id, outcome = enqueue_task(task_data)
+    logging.info("Job %s added for scrape_url with URL %s (cache %s)", job_id, url, outcome)
+    return jsonify({"job_id": job_id})
+
+
+@app.route('/scrape/urls', methods=['POST'])
+def scrape_urls():
+    if not validate_api_key():
+        return jsonify({"error": "Invalid API Key."}), 401
+
+    data = request.json
+    urls = data.get("urls")
+    if not urls or not isinstance(urls, list) or not all(isinstance(url, str) and url for url in urls):
+        return jsonify({"error": "A non-empty list of URLs is required."}), 400
+    if len(urls) > MAX_BATCH_URLS:
+        return jsonify({"error": f"At most {MAX_BATCH_URLS} URLs per batch."}), 400
+
+    job_id = str(uuid.uuid4())
+    task_data = {"type": "urls", "urls": urls, "job_id": job_id}
+    job_id, outcome = enqueue_task(task_data)
+    logging.info("Job %s added for scrape_urls with %s URLs (cache %s)", job_id, len(urls), outcome)
+    return jsonify({"job_id": job_id})
+
+
+@app.route('/scrape/screenshot', methods=['POST'])
+def scrape_screenshot():
+    if not validate_api_key():
+        return jsonify({"error": "Invalid API Key."}), 401
+
+    data = request.json
+    url = data.get("url")
+    if not url:
+        return jsonify({"error": "URL is required."}), 400
+
+    job_id = str(uuid.uuid4())
+    task_data = {"type": "screenshot", "url": url, "job_id": job_id}
+    job_id, outcome = enqueue_task(task_data)
+    logging.info("Job %s added for scrape_screenshot with URL %s (cache %s)", job_id, url, outcome)
     return jsonify({"job_id": job_id})
 
 
@@ -102,26 +205,223 @@ def scrape_by_category():
 
     job_id = str(uuid.uuid4())
     task_data = {"type": "category", "postal_code": postal_code, "category": category, "job_id": job_id}
-    channel.basic_publish(
-        exchange="",
-        routing_key="task_queue",
-        body=json.dumps(task_data),
-        properties=pika.BasicProperties(delivery_mode=2)
-    )
-    redis_client.set(job_id, json.dumps({"status": "pending"}))
-    logging.info(f"Job {job_id} added for scrape_by_category with postal code {postal_code} and category {category}")
+    job_id, outcome = enqueue_task(task_data)
+    logging.info("Job %s added for scrape_by_category with postal code %s and category %s (cache %s)", job_id, postal_code, category, outcome)
+    return jsonify({"job_id": job_id})
+
+
+# Changes to a category since it was last scraped: added/removed/changed flyers, items
+# for the new and changed ones, and the full listing as of now
+@app.route('/scrape/category/delta', methods=['POST'])
+def scrape_category_delta():
+    if not validate_api_key():
+        return jsonify({"error": "Invalid API Key."}), 401
+
+    data = request.json
+    postal_code = data.get("postal_code")
+    category = data.get("category")
+    if not postal_code or not category:
+        return jsonify({"error": "Postal code and category are required."}), 400
+
+    job_id = str(uuid.uuid4())
+    task_data = {"type": "category_delta", "postal_code": postal_code, "category": category, "job_id": job_id}
+    job_id, outcome = enqueue_task(task_data)
+    logging.info("Job %s added for scrape_category_delta with postal code %s and category %s (cache %s)", job_id, postal_code, category, outcome)
     return jsonify({"job_id": job_id})
 
 
+# Run a categories or category scrape across many postal codes, once per market. Takes
+# a list of postal_codes, or a prefix matching postal codes seen in earlier sweeps.
+# Progress (markets_done of markets_total) is reported on the job status.
+@app.route('/scrape/sweep', methods=['POST'])
+def scrape_sweep():
+    if not validate_api_key():
+        return jsonify({"error": "Invalid API Key."}), 401
+
+    data = request.json
+    job = data.get("job")
+    category = data.get("category")
+    postal_codes = data.get("postal_codes")
+    prefix = data.get("prefix")
+    if job not in SWEEP_JOBS:
+        return jsonify({"error": f"Job must be one of: {', '.join(SWEEP_JOBS)}."}), 400
+    if job == "category" and not category:
+        return jsonify({"error": "Category is required."}), 400
+    if prefix and not postal_codes:
+        postal_codes = markets.known_postal_codes(redis_client, prefix)
+        if not postal_codes:
+            return jsonify({"error": f"No known postal codes start with {prefix}; sweep them by list first."}), 400
+    if not postal_codes or not isinstance(postal_codes, list) or not all(isinstance(code, str) and code.strip() for code in postal_codes):
+        return jsonify({"error": "A non-empty list of postal codes or a prefix is required."}), 400
+    if len(postal_codes) > MAX_SWEEP_POSTAL_CODES:
+        return jsonify({"error": f"At most {MAX_SWEEP_POSTAL_CODES} postal codes per sweep."}), 400
+
+    job_id = str(uuid.uuid4())
+    task_data = {"type": "sweep", "job": job, "postal_codes": postal_codes, "job_id": job_id}
+    if job == "category":
+        task_data["category"] = category
+    job_id, outcome = enqueue_task(task_data)
+    logging.info("Job %s added for scrape_sweep (%s) with %s postal codes (cache %s)", job_id, job, len(postal_codes), outcome)
+    return jsonify({"job_id": job_id})
+
+
+# Search flyer items already scraped: ?q=<text>&min_price=&max_price=&brand=&postal_code=<prefix>
+# &current=true (valid now)&limit=N, cheapest first. Pass the returned next_cursor as ?cursor=
+# for the next page. Only the local index is read; nothing is scraped.
+@app.route('/items/search', methods=['GET'])
+def search_items():
+    if not validate_api_key():
+        return jsonify({"error": "Invalid API Key."}), 401
+
+    try:
+        min_price = float(request.args["min_price"]) if "min_price" in request.args else None
+        max_price = float(request.args["max_price"]) if "max_price" in request.args else None
+        limit = int(request.args.get("limit", SEARCH_PAGE_LIMIT))
+    except ValueError:
+        return jsonify({"error": "min_price and max_price must be numbers and limit an integer."}), 400
+    if limit < 1 or limit > SEARCH_MAX_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {SEARCH_MAX_LIMIT}."}), 400
+    cursor = request.args.get("cursor")
+    try:
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor."}), 400
+
+    items, next_cursor = item_store.search(
+        text=request.args.get("q"), min_price=min_price, max_price=max_price, brand=request.args.get("brand"),
+        postal_code=request.args.get("postal_code"),
+        valid_at=time.time() if request.args.get("current", "").lower() == "true" else None,
+        limit=limit, cursor=cursor)
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
 @app.route('/job/status/<job_id>', methods=['GET'])
 def job_status(job_id):
-    job_data = redis_client.get(job_id)
+    job_data = job_store.get_status(redis_client, job_id)
     if not job_data:
         return jsonify({"error": "Job ID not found."}), 404
 
-    job_data = json.loads(job_data)
+    # Polls get metadata only; the result is loaded on request, a page at a time for item lists
+    if request.args.get("include") == "result" and job_data["status"] == "completed":
+        try:
+            offset = max(int(request.args.get("offset", 0)), 0)
+            limit = int(request.args["limit"]) if "limit" in request.args else None
+        except ValueError:
+            return jsonify({"error": "offset and limit must be integers."}), 400
+        job_data["result"] = job_store.load_result(redis_client, job_id, job_data, offset, limit)
+        if job_data.get("result_format") == "items":
+            job_data["offset"] = offset
     return jsonify(job_data)
 
 
+def sse_event(job_data):
+    return f"event: status\ndata: {json.dumps(job_data)}\n\n"
+
+
+# Server-sent events: the current status, then every transition until the job finishes
+@app.route('/job/events/<job_id>', methods=['GET'])
+def job_events_stream(job_id):
+    if not job_store.exists(redis_client, job_id):
+        return jsonify({"error": "Job ID not found."}), 404
+
+    def generate():
+        with job_events.watch(job_id) as events:
+            job_data = job_store.get_status(redis_client, job_id)
+            if job_data is None:
+                return
+            yield sse_event(job_data)
+            deadline = time.monotonic() + JOB_EVENTS_MAX_SECONDS
+            while job_data["status"] not in job_store.TERMINAL_STATUSES and time.monotonic() < deadline:
+                try:
+                    job_data = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_event(job_data)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# The stitched PNG of a completed screenshot job
+@app.route('/screenshot/<job_id>', methods=['GET'])
+def screenshot_file(job_id):
+    job_data = job_store.get_status(redis_client, job_id)
+    if not job_data or job_data.get("type") != "screenshot":
+        return jsonify({"error": "Screenshot job not found."}), 404
+    if job_data["status"] != "completed":
+        return jsonify({"error": f"Job is {job_data['status']}.", "status": job_data["status"]}), 409
+
+    directory = os.path.abspath(os.path.join(SCREENSHOT_DIR, job_id))
+    if not os.path.isfile(os.path.join(directory, "flyer.png")):
+        return jsonify({"error": "Screenshot is not available on this server."}), 404
+    return send_from_directory(directory, "flyer.png", mimetype="image/png")
+
+
+# Long poll: answers as soon as the job finishes, or with its current status after ?timeout= seconds
+@app.route('/job/wait/<job_id>', methods=['GET'])
+def job_wait(job_id):
+    try:
+        timeout = min(max(float(request.args.get("timeout", 30)), 0), JOB_WAIT_MAX_SECONDS)
+    except ValueError:
+        return jsonify({"error": "timeout must be a number."}), 400
+
+    with job_events.watch(job_id) as events:
+        job_data = job_store.get_status(redis_client, job_id)
+        if not job_data:
+            return jsonify({"error": "Job ID not found."}), 404
+        deadline = time.monotonic() + timeout
+        while job_data["status"] not in job_store.TERMINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job_data = events.get(timeout=remaining)
+            except queue.Empty:
+                break
+    # Events only carry the fields a transition changed
+    return jsonify(job_store.get_status(redis_client, job_id) or job_data)
+
+
+@app.route('/jobs/stats', methods=['GET'])
+def jobs_stats():
+    if not validate_api_key():
+        return jsonify({"error": "Invalid API Key."}), 401
+
+    return jsonify(job_store.get_timing_stats(redis_client, list(scheduler.JOB_CLASSES)))
+
+
+# Prometheus scrape target for the API; workers export their own on WORKER_METRICS_PORT
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    if not validate_api_key():
+        return jsonify({"error": "Invalid API Key."}), 401
+
+    return jsonify(result_cache.get_stats(redis_client))
+
+
+@app.route('/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    if not validate_api_key():
+        return jsonify({"error": "Invalid API Key."}), 401
+
+    depths = publisher.queue_depths()
+    return jsonify(scheduler.get_stats(redis_client, {name: depths.get(queue_name) for name, queue_name in scheduler.QUEUES.items()}))
+
+
+@app.route('/logging/stats', methods=['GET'])
+def logging_stats():
+    if not validate_api_key():
+        return jsonify({"error": "Invalid API Key."}), 401
+
+    return jsonify(log_stats())
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
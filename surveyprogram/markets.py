@@ -0,0 +1,74 @@
+import os
+import re
+import hashlib
+
+# Neighbouring postal codes almost always get the same flyers, so a sweep scrapes once
+# per market instead of once per postal code. A market is identified by the set of
+# flyer ids served to a postal code; the answer is cached per postal code and recorded
+# under its FSA (first three characters), where it stands in for codes whose flyer
+# list can't be fetched. Kept free of scraper imports so the API can expand prefixes.
+MARKET_KEY = "market:postal:{postal_code}"
+FSA_MARKETS_KEY = "market:fsa:{fsa}"
+MARKET_TTL = int(os.getenv("MARKET_TTL", str(24 * 3600)))
+
+
+def normalize(postal_code):
+    return re.sub(r"\s+", "", postal_code).upper()
+
+
+def fsa(postal_code):
+    return normalize(postal_code)[:3]
+
+
+def market_from_flyers(flyers):
+    flyer_ids = ",".join(sorted(str(flyer["id"]) for flyer in flyers))
+    return "flyers:" + hashlib.sha1(flyer_ids.encode()).hexdigest()[:16]
+
+
+def learn(redis_client, postal_code, market):
+    postal_code = normalize(postal_code)
+    fsa_key = FSA_MARKETS_KEY.format(fsa=fsa(postal_code))
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(MARKET_KEY.format(postal_code=postal_code), market, ex=MARKET_TTL)
+    pipe.hset(fsa_key, postal_code, market)
+    pipe.expire(fsa_key, MARKET_TTL)
+    pipe.execute()
+
+
+# The FSA's market when every postal code learned under it agrees, else the FSA itself
+def fsa_market(redis_client, postal_code):
+    markets = {market.decode() for market in redis_client.hvals(FSA_MARKETS_KEY.format(fsa=fsa(postal_code)))}
+    return markets.pop() if len(markets) == 1 else f"fsa:{fsa(postal_code)}"
+
+
+# fetch_flyers(redis_client, postal_code) is flipp_api.fetch_flyers
+def resolve(redis_client, postal_code, fetch_flyers):
+    postal_code = normalize(postal_code)
+    cached = redis_client.get(MARKET_KEY.format(postal_code=postal_code))
+    if cached is not None:
+        return cached.decode()
+    try:
+        market = market_from_flyers(fetch_flyers(redis_client, postal_code))
+    except Exception as e:
+        print(f"Could not fetch the flyer list for {postal_code}, falling back to its FSA: {e}")
+        return fsa_market(redis_client, postal_code)
+    learn(redis_client, postal_code, market)
+    return market
+
+
+# market -> postal codes, in the order the codes were given
+def group_by_market(redis_client, postal_codes, fetch_flyers):
+    groups = {}
+    for postal_code in dict.fromkeys(normalize(postal_code) for postal_code in postal_codes):
+        groups.setdefault(resolve(redis_client, postal_code, fetch_flyers), []).append(postal_code)
+    return groups
+
+
+# Postal codes seen so far that start with prefix
+def known_postal_codes(redis_client, prefix):
+    prefix = normalize(prefix)
+    pattern = FSA_MARKETS_KEY.format(fsa=prefix[:3] if len(prefix) >= 3 else prefix + "*")
+    postal_codes = set()
+    for key in redis_client.scan_iter(match=pattern):
+        postal_codes.update(postal_code.decode() for postal_code in redis_client.hkeys(key))
+    return sorted(postal_code for postal_code in postal_codes if postal_code.startswith(prefix))
@@ -0,0 +1,62 @@
+import struct
+import zlib
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Compressed output is flushed to disk in chunks of about this size
+IDAT_CHUNK_SIZE = 256 * 1024
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+# Writes an RGB PNG one horizontal strip at a time, so memory stays bounded by the size
+# of a strip however tall the image gets. The final height is only known at close(),
+# when the IHDR written up front is patched in place.
+class StreamingPNGWriter:
+    def __init__(self, path, width, level=6):
+        self.width = width
+        self.height = 0
+        self._file = open(path, "wb")
+        self._compressor = zlib.compressobj(level)
+        self._pending = bytearray()
+        self._file.write(PNG_SIGNATURE)
+        self._file.write(png_chunk(b"IHDR", self._header()))
+
+    def _header(self):
+        # 8-bit RGB, no interlacing
+        return struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0)
+
+    def _write(self, data):
+        self._pending += data
+        if len(self._pending) >= IDAT_CHUNK_SIZE:
+            self._file.write(png_chunk(b"IDAT", bytes(self._pending)))
+            self._pending.clear()
+
+    # Append a PIL image below what has been written so far; strips narrower or wider
+    # than the output are padded or cropped on the right
+    def add_strip(self, image):
+        image = image.convert("RGB")
+        if image.width != self.width:
+            image = image.crop((0, 0, self.width, image.height))
+        raw = image.tobytes()
+        stride = self.width * 3
+        for row in range(image.height):
+            # Each scanline starts with its filter type (0: none)
+            self._write(self._compressor.compress(b"\x00" + raw[row * stride:(row + 1) * stride]))
+        self.height += image.height
+
+    def close(self):
+        self._write(self._compressor.flush())
+        if self._pending:
+            self._file.write(png_chunk(b"IDAT", bytes(self._pending)))
+        self._file.write(png_chunk(b"IEND", b""))
+        self._file.seek(len(PNG_SIGNATURE))
+        self._file.write(png_chunk(b"IHDR", self._header()))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
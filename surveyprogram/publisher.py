@@ -0,0 +1,99 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+import pika
+from pika.exceptions import AMQPError, NackError, UnroutableError
+
+PUBLISH_TIMEOUT = 10
+PUBLISH_ATTEMPTS = 3
+RECONNECT_DELAY = 1.0
+
+
+class PublishError(Exception):
+    pass
+
+
+# Thread-safe, reconnecting RabbitMQ publisher with publisher confirms.
+# pika connections must only be used from the thread that created them, so each of the
+# `size` publisher threads owns one connection and request threads hand messages over
+# through a shared queue, then wait for the broker's confirm.
+class Publisher:
+    def __init__(self, host, queues, size=2):
+        self.host = host
+        self.queues = queues
+        self._requests = queue.Queue()
+        for number in range(size):
+            threading.Thread(target=self._run, name=f"publisher-{number}", daemon=True).start()
+
+    def publish(self, body, routing_key, timeout=PUBLISH_TIMEOUT):
+        def operation(channel):
+            # With confirms on, this returns once the broker has taken the message
+            channel.basic_publish(
+                exchange="",
+                routing_key=routing_key,
+                body=body,
+                properties=pika.BasicProperties(delivery_mode=2),  # Make message persistent
+                mandatory=True
+            )
+        try:
+            return self._submit(operation, timeout)
+        except Exception as e:
+            raise PublishError(f"Could not publish to {routing_key}: {e}") from e
+
+    # Messages waiting in each declared queue, or None for a queue the broker couldn't report
+    def queue_depths(self, timeout=PUBLISH_TIMEOUT):
+        def operation(channel):
+            return {name: channel.queue_declare(queue=name, durable=True, passive=True).method.message_count
+                    for name in self.queues}
+        try:
+            return self._submit(operation, timeout)
+        except Exception as e:
+            logging.warning("Could not read queue depths: %r", e)
+            return dict.fromkeys(self.queues)
+
+    # Run operation(channel) on one of the publisher threads and wait for its result
+    def _submit(self, operation, timeout):
+        future = Future()
+        self._requests.put((operation, future))
+        return future.result(timeout)
+
+    def _connect(self):
+        connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
+        channel = connection.channel()
+        for name in self.queues:
+            channel.queue_declare(queue=name, durable=True)
+        channel.confirm_delivery()
+        return connection, channel
+
+    def _run(self):
+        connection = channel = None
+        while True:
+            try:
+                operation, future = self._requests.get(timeout=1)
+            except queue.Empty:
+                # Idle: keep servicing heartbeats so the broker doesn't drop us
+                if connection is not None:
+                    try:
+                        connection.process_data_events(time_limit=0)
+                    except AMQPError:
+                        connection = channel = None
+                continue
+
+            for attempt in range(1, PUBLISH_ATTEMPTS + 1):
+                try:
+                    if connection is None or connection.is_closed:
+                        connection, channel = self._connect()
+                    future.set_result(operation(channel))
+                    break
+                except (NackError, UnroutableError) as e:
+                    future.set_exception(e)
+                    break
+                except AMQPError as e:
+                    logging.warning("Publisher attempt %s failed, reconnecting: %r", attempt, e)
+                    connection = channel = None
+                    if attempt == PUBLISH_ATTEMPTS:
+                        future.set_exception(e)
+                    else:
+                        time.sleep(RECONNECT_DELAY)
@@ -0,0 +1,57 @@
+import os
+import time
+import asyncio
+import redis
+
+# Shared budget for requests to flipp, across every worker process and box
+FLIPP_RATE = float(os.getenv("FLIPP_RATE", "5"))  # requests per second
+FLIPP_BURST = int(os.getenv("FLIPP_BURST", "10"))
+FLIPP_DOMAINS = ["flipp.com", "flippback.com", "wishabi.com", "wishabi.net"]
+
+# Redis setup
+redis_client = redis.StrictRedis(host="localhost", port=6379, db=0)
+
+# Refill the bucket for the time elapsed since the last call, then take `cost` tokens
+# if there are enough. Returns how long the caller should wait before trying again
+# (0 when the tokens were granted).
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+if tokens < cost then
+    return tostring((cost - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens - cost, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return '0'
+"""
+
+
+class TokenBucket:
+    def __init__(self, redis_client, key, rate, burst):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self._script = redis_client.register_script(TOKEN_BUCKET_LUA)
+
+    def try_acquire(self, cost=1):
+        cost = min(cost, self.burst)
+        return float(self._script(keys=[self.key], args=[self.rate, self.burst, time.time(), cost]))
+
+    def acquire(self, cost=1):
+        while (wait := self.try_acquire(cost)) > 0:
+            time.sleep(wait)
+
+    # For the worker's event loop: the script round trip runs on the loop's executor
+    async def acquire_async(self, cost=1):
+        loop = asyncio.get_running_loop()
+        while (wait := await loop.run_in_executor(None, self.try_acquire, cost)) > 0:
+            await asyncio.sleep(wait)
+
+
+flipp_bucket = TokenBucket(redis_client, "ratelimit:flipp", FLIPP_RATE, FLIPP_BURST)
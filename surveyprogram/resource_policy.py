@@ -0,0 +1,74 @@
+from urllib.parse import urlparse
+from metrics import Counter
+
+# Third-party hosts that never contribute to the data we scrape. Long-polling trackers
+# among them are also what used to keep 'networkidle' from ever settling.
+TRACKER_DOMAINS = [
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "googleadservices.com", "facebook.net", "facebook.com", "hotjar.com", "segment.io",
+    "segment.com", "cookieyes.com", "bing.com", "adsrvr.org", "amazon-adsystem.com",
+    "scorecardresearch.com", "nr-data.net", "sentry.io", "branch.io", "criteo.com", "taboola.com",
+]
+
+BROWSER_REQUESTS = Counter("scrape_browser_requests", "Browser requests by job type and resource policy outcome.", ["job_type", "outcome"])
+
+# Per job type:
+#   block_types   - Playwright resource types to abort
+#   allow_domains - hosts exempt from block_types
+#   block_domains - hosts aborted whatever the resource type
+POLICIES = {
+    "categories": {
+        "block_types": {"image", "media", "font"},
+        "allow_domains": [],
+        "block_domains": TRACKER_DOMAINS,
+    },
+    "category": {
+        # Thumbnail URLs are read from the src attribute, the image bytes are never needed
+        "block_types": {"image", "media", "font"},
+        "allow_domains": [],
+        "block_domains": TRACKER_DOMAINS,
+    },
+    "screenshot": {
+        # The flyer canvas is painted from images, so they have to load
+        "block_types": {"media", "font"},
+        "allow_domains": [],
+        "block_domains": TRACKER_DOMAINS,
+    },
+    "default": {
+        "block_types": set(),
+        "allow_domains": [],
+        "block_domains": TRACKER_DOMAINS,
+    },
+}
+
+
+def domain_matches(host, domains):
+    return any(host == domain or host.endswith("." + domain) for domain in domains)
+
+
+def is_blocked(policy, resource_type, url):
+    host = urlparse(url).hostname or ""
+    if domain_matches(host, policy["block_domains"]):
+        return True
+    return resource_type in policy["block_types"] and not domain_matches(host, policy["allow_domains"])
+
+
+# Route every request of the context through the job type's policy. Returns live
+# counters for the context; totals per job type are exported as scrape_browser_requests.
+async def apply_resource_policy(context, job_type):
+    policy = POLICIES.get(job_type, POLICIES["default"])
+    stats = {"allowed": 0, "blocked": 0}
+
+    async def handle(route):
+        request = route.request
+        if is_blocked(policy, request.resource_type, request.url):
+            stats["blocked"] += 1
+            BROWSER_REQUESTS.inc(job_type=job_type, outcome="blocked")
+            await route.abort()
+        else:
+            stats["allowed"] += 1
+            BROWSER_REQUESTS.inc(job_type=job_type, outcome="allowed")
+            await route.continue_()
+
+    await context.route("**/*", handle)
+    return stats
@@ -0,0 +1,141 @@
+import os
+import re
+import hashlib
+from datetime import datetime, timezone
+import job_store
+
+# How long a completed result is served from cache, per job type. Results with
+# valid_to dates never outlive the earliest one.
+CACHE_TTLS = {
+    "categories": int(os.getenv("CACHE_TTL_CATEGORIES", str(6 * 3600))),
+    "category": int(os.getenv("CACHE_TTL_CATEGORY", str(6 * 3600))),
+    # Deltas are cheap to recompute, and a stale one would hide changes
+    "category_delta": int(os.getenv("CACHE_TTL_CATEGORY_DELTA", str(15 * 60))),
+    "url": int(os.getenv("CACHE_TTL_URL", str(7 * 24 * 3600))),
+    "urls": int(os.getenv("CACHE_TTL_URL", str(7 * 24 * 3600))),
+    "screenshot": int(os.getenv("CACHE_TTL_SCREENSHOT", str(24 * 3600))),
+    "sweep": int(os.getenv("CACHE_TTL_SWEEP", str(6 * 3600))),
+}
+# Safety net for a claim whose job never finishes (e.g. the worker died)
+CACHE_INFLIGHT_TTL = int(os.getenv("CACHE_INFLIGHT_TTL", "3600"))
+CACHE_MIN_TTL = 60
+
+STATS_KEY = "cache:stats"
+
+
+def flyer_id(url):
+    match = re.search(r'/flyer/(\d+)-', url)
+    return match.group(1) if match else url
+
+
+# (job type, postal code, category, flyer id)
+def cache_key(task):
+    postal_code = re.sub(r"\s+", "", task.get("postal_code") or "").upper()
+    category = (task.get("category") or "").lower()
+    flyer = ""
+    if task.get("url"):
+        flyer = flyer_id(task["url"])
+    elif task.get("urls"):
+        # A batch is identified by its whole flyer set, whatever order it came in
+        flyer_ids = ",".join(sorted(set(flyer_id(url) for url in task["urls"])))
+        flyer = hashlib.sha1(flyer_ids.encode()).hexdigest()
+    elif task.get("postal_codes"):
+        # Likewise a sweep, by the job it runs and its postal code set
+        postal_codes = ",".join(sorted(set(re.sub(r"\s+", "", code).upper() for code in task["postal_codes"])))
+        flyer = hashlib.sha1(f"{task['job']}:{postal_codes}".encode()).hexdigest()
+    return f"cache:{task['type']}:{postal_code}:{category}:{flyer}"
+
+
+# Claim the cache entry for a task. Returns (job_id, outcome):
+#   "hit"       - a completed job already holds the result
+#   "coalesced" - an identical job is queued or running, share it
+#   "miss"      - the caller's own job_id now owns the entry and must be published
+def claim(redis_client, task):
+    key = cache_key(task)
+    for _ in range(2):
+        if redis_client.set(key, task["job_id"], nx=True, ex=CACHE_INFLIGHT_TTL):
+            break
+
+        existing = redis_client.get(key)
+        if existing is None:
+            continue
+        existing = existing.decode()
+        status = job_store.get_state(redis_client, existing)
+        if status == "completed":
+            redis_client.hincrby(STATS_KEY, "hit", 1)
+            return existing, "hit"
+        if status not in ("failed", None):
+            redis_client.hincrby(STATS_KEY, "coalesced", 1)
+            return existing, "coalesced"
+
+        # The last attempt failed, or its record is gone (scheduler.enqueue writes it
+        # before claiming, so a missing one has expired or been deleted and would 404);
+        # drop it and claim afresh
+        release(redis_client, task | {"job_id": existing})
+
+    redis_client.hincrby(STATS_KEY, "miss", 1)
+    return task["job_id"], "miss"
+
+
+def earliest_valid_to(result):
+    valid_tos = []
+    # Batch results map each URL to its flyer's items
+    items = result
+    if isinstance(result, dict):
+        items = [item for flyer in result.values() if isinstance(flyer, list) for item in flyer]
+    if isinstance(items, list):
+        for item in items:
+            try:
+                valid_tos.append(datetime.fromisoformat(item["valid_to"]))
+            except (TypeError, KeyError, ValueError):
+                continue
+    return min(valid_tos, default=None)
+
+
+# An empty listing (or one empty per sort order) is more likely a page that didn't load
+# than a postal code without flyers
+def is_empty(result):
+    if isinstance(result, dict) and result and all(isinstance(value, list) for value in result.values()):
+        return not any(result.values())
+    return not result
+
+
+def ttl_for(task, result):
+    if is_empty(result):
+        return CACHE_MIN_TTL
+    ttl = CACHE_TTLS.get(task["type"], CACHE_MIN_TTL)
+    # Don't pin a batch with failed flyers (or a sweep with failed markets) for days;
+    # let it be retried soon
+    if isinstance(result, dict) and any(isinstance(flyer, dict) and "error" in flyer for flyer in result.values()):
+        return CACHE_MIN_TTL
+    if task["type"] == "sweep" and any("error" in market for market in result["markets"].values()):
+        return CACHE_MIN_TTL
+    valid_to = earliest_valid_to(result)
+    if valid_to is not None:
+        if valid_to.tzinfo is None:
+            valid_to = valid_to.replace(tzinfo=timezone.utc)
+        seconds_left = int((valid_to - datetime.now(timezone.utc)).total_seconds())
+        ttl = min(ttl, max(seconds_left, CACHE_MIN_TTL))
+    return ttl
+
+
+def owns_entry(redis_client, task):
+    owner = redis_client.get(cache_key(task))
+    return owner is not None and owner.decode() == task["job_id"]
+
+
+# Called by the worker once a job completes: keep the entry for the result's lifetime
+def store(redis_client, task, result):
+    if owns_entry(redis_client, task):
+        redis_client.expire(cache_key(task), ttl_for(task, result))
+
+
+# Called by the worker when a job fails, so the next request scrapes again
+def release(redis_client, task):
+    if owns_entry(redis_client, task):
+        redis_client.delete(cache_key(task))
+
+
+def get_stats(redis_client):
+    stats = {name.decode(): int(count) for name, count in redis_client.hgetall(STATS_KEY).items()}
+    return {outcome: stats.get(outcome, 0) for outcome in ("hit", "miss", "coalesced")}
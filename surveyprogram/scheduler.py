@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import job_store
+import result_cache
+from job_store import percentile
+from publisher import PublishError
+
+# Cheap API jobs and slow browser jobs get their own queues, so a burst of flyer
+# lookups never waits behind Playwright scrapes. Sweeps mostly wait on the jobs they fan
+# out, so they get a queue of their own rather than holding fast slots. Workers choose
+# which classes to consume.
+JOB_CLASSES = {
+    "url": "fast",
+    "urls": "fast",
+    "categories": "browser",
+    "category": "browser",
+    "category_delta": "browser",
+    "screenshot": "browser",
+    "sweep": "sweep",
+}
+QUEUES = {
+    "fast": "fast_tasks",
+    "browser": "browser_tasks",
+    "sweep": "sweep_tasks",
+}
+# Single queue every job went to before the split. Workers move anything still in it
+# onto its class's queue; set LEGACY_QUEUE to an empty string once it has drained.
+LEGACY_QUEUE = os.getenv("LEGACY_QUEUE", "task_queue")
+
+# Recent queue waits kept per class for the stats endpoint
+WAITS_KEY = "scheduler:waits:{job_class}"
+WAIT_SAMPLES = 1000
+
+
+def job_class(task):
+    return JOB_CLASSES[task["type"]]
+
+
+def queue_for(task):
+    return QUEUES[job_class(task)]
+
+
+# Publish a task to its class's queue unless an identical one is already cached or in
+# flight; the cache claim, keyed on the task parameters, is what deduplicates.
+# Returns the job id to hand back and the cache outcome ("hit", "coalesced" or "miss").
+def enqueue(redis_client, publisher, task):
+    task["enqueued_at"] = time.time()
+    job_store.set_status(redis_client, task["job_id"], "pending", type=task["type"], enqueued_at=task["enqueued_at"])
+    job_id, outcome = result_cache.claim(redis_client, task)
+    if outcome != "miss":
+        job_store.delete(redis_client, task["job_id"])
+        return job_id, outcome
+
+    try:
+        publisher.publish(json.dumps(task), routing_key=queue_for(task))
+    except PublishError:
+        # Don't leave a claim pointing at a job no worker will ever see
+        result_cache.release(redis_client, task)
+        job_store.set_status(redis_client, job_id, "failed", error="Could not queue the job.")
+        raise
+    return job_id, outcome
+
+
+# Called by the worker when it picks a task up
+def record_wait(redis_client, task):
+    if "enqueued_at" not in task:
+        return None
+    wait_ms = max(0, int((time.time() - task["enqueued_at"]) * 1000))
+    key = WAITS_KEY.format(job_class=job_class(task))
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.lpush(key, wait_ms)
+    pipe.ltrim(key, 0, WAIT_SAMPLES - 1)
+    pipe.execute()
+    return wait_ms
+
+
+# depths maps each class to its broker queue depth (None if unknown)
+def get_stats(redis_client, depths):
+    pipe = redis_client.pipeline(transaction=False)
+    for name in QUEUES:
+        pipe.lrange(WAITS_KEY.format(job_class=name), 0, -1)
+    waits = pipe.execute()
+
+    stats = {}
+    for (name, queue_name), samples in zip(QUEUES.items(), waits):
+        samples = [int(sample) for sample in samples]
+        stats[name] = {
+            "queue": queue_name,
+            "depth": depths.get(name),
+            "wait_ms": {
+                "samples": len(samples),
+                "p50": percentile(samples, 0.5),
+                "p95": percentile(samples, 0.95),
+                "max": max(samples, default=None),
+            },
+        }
+    return stats
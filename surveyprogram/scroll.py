@@ -0,0 +1,55 @@
+import os
+import time
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+# Scroll limits: how long to wait for the next batch before calling the list complete,
+# and hard caps on total time and rendered items per page (0 means no item cap)
+SCROLL_SETTLE_MS = int(os.getenv("SCROLL_SETTLE_MS", "1500"))
+SCROLL_MAX_DURATION_MS = int(os.getenv("SCROLL_MAX_DURATION_MS", "60000"))
+SCROLL_MAX_ITEMS = int(os.getenv("SCROLL_MAX_ITEMS", "0"))
+
+# Scroll to the bottom and report how many items are rendered right now
+SCROLL_AND_COUNT_JS = """
+selector => {
+    window.scrollTo(0, document.body.scrollHeight);
+    return document.querySelectorAll(selector).length;
+}
+"""
+
+# Becomes truthy as soon as the next batch of items is rendered
+WAIT_FOR_MORE_JS = """
+([selector, count]) => document.querySelectorAll(selector).length > count
+"""
+
+
+# Scroll an infinite list until it stops growing. Instead of sleeping a fixed second per
+# scroll, each iteration waits only until more items appear, so a page costs one settle
+# timeout at the very end rather than a second per batch.
+# should_stop(page, count), if given, is awaited after every batch and ends the scroll
+# early when it returns True.
+async def scroll_to_end(page, item_selector='flipp-flyer-listing-item', max_duration_ms=SCROLL_MAX_DURATION_MS,
+                        max_items=SCROLL_MAX_ITEMS, settle_ms=SCROLL_SETTLE_MS, should_stop=None):
+    started = time.monotonic()
+    iterations = 0
+    count = await page.evaluate(SCROLL_AND_COUNT_JS, item_selector)
+
+    while not (max_items and count >= max_items):
+        if should_stop is not None and await should_stop(page, count):
+            break
+        remaining_ms = max_duration_ms - (time.monotonic() - started) * 1000
+        if remaining_ms <= 0:
+            break
+
+        iterations += 1
+        try:
+            await page.wait_for_function(WAIT_FOR_MORE_JS, arg=[item_selector, count],
+                                         timeout=min(settle_ms, remaining_ms))
+        except PlaywrightTimeoutError:
+            break
+        count = await page.evaluate(SCROLL_AND_COUNT_JS, item_selector)
+
+    return {
+        "iterations": iterations,
+        "items": count,
+        "elapsed_ms": round((time.monotonic() - started) * 1000),
+    }
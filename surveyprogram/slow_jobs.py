@@ -0,0 +1,68 @@
+import os
+import time
+import cProfile
+from contextlib import asynccontextmanager, contextmanager
+
+# Opt-in diagnostics for slow jobs: with SLOW_JOB_SECONDS set, jobs that take longer
+# leave a Playwright trace ("trace") or a cProfile dump ("cprofile") in SLOW_JOB_DIR
+SLOW_JOB_SECONDS = float(os.getenv("SLOW_JOB_SECONDS", "0"))
+SLOW_JOB_PROFILE = os.getenv("SLOW_JOB_PROFILE", "trace")
+SLOW_JOB_DIR = os.getenv("SLOW_JOB_DIR", "slow_jobs")
+
+# Only one profiler can be active at a time
+profiling = False
+
+
+def enabled(mode):
+    return SLOW_JOB_SECONDS > 0 and SLOW_JOB_PROFILE == mode
+
+
+def dump_path(task, extension):
+    os.makedirs(SLOW_JOB_DIR, exist_ok=True)
+    return os.path.join(SLOW_JOB_DIR, f"{task['type']}-{task['job_id']}.{extension}")
+
+
+# Trace the job's browser context, and keep the trace only if the job was slow.
+# Open it with `playwright show-trace <file>`.
+@asynccontextmanager
+async def trace_if_slow(context, task):
+    if not enabled("trace"):
+        yield
+        return
+
+    await context.tracing.start(screenshots=True, snapshots=True)
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        if time.monotonic() - started >= SLOW_JOB_SECONDS:
+            path = dump_path(task, "zip")
+            await context.tracing.stop(path=path)
+            print(f"Job {task['job_id']} was slow, trace saved to {path}")
+        else:
+            await context.tracing.stop()
+
+
+# Profile the worker's event loop thread while the job runs, and keep the profile only
+# if the job was slow. Other jobs on the loop show up too, so profile with
+# WORKER_CONCURRENCY=1 for a clean picture. Open it with `python -m pstats <file>`.
+@contextmanager
+def profile_if_slow(task):
+    global profiling
+    if not enabled("cprofile") or profiling:
+        yield
+        return
+
+    profiling = True
+    profiler = cProfile.Profile()
+    started = time.monotonic()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiling = False
+        if time.monotonic() - started >= SLOW_JOB_SECONDS:
+            path = dump_path(task, "prof")
+            profiler.dump_stats(path)
+            print(f"Job {task['job_id']} was slow, profile saved to {path}")
@@ -1,42 +1,456 @@
+import os
 import json
+import time
+import uuid
+import shutil
+import socket
 import pika
 import redis
 import asyncio
+import functools
+import traceback
+import threading
+import contextvars
+import multiprocessing
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import flipp_api
+import job_store
+import scheduler
+import result_cache
+import flyer_delta
+import markets
+from browser_pool import BrowserPool
+from publisher import Publisher
+from item_store import ItemStore
+from metrics import REGISTRY, QUEUE_DEPTH, Counter, Gauge, Histogram, span, start_exporter
+from slow_jobs import trace_if_slow, profile_if_slow
+from resource_policy import apply_resource_policy
 from get_categories import scrape_flyer_categories
-from get_flyer import scrape_flyer
-from get_flyers_by_category import scrape_flyers_by_category
+from get_flyer import scrape_flyer, scrape_flyers
+from get_flyers_by_category import scrape_flyers_by_category, scrape_latest_until_known, SORTING_OPTIONS
+from get_flyer_screenshot import scrape_flyer_screenshot, SCREENSHOT_DIR
+from rate_limit import flipp_bucket
+
+# Worker configuration: job classes consumed, jobs of each class run at once per
+# process, and consumer processes per box
+WORKER_CLASSES = os.getenv("WORKER_CLASSES", "fast,browser,sweep").split(",")
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+FAST_CONCURRENCY = int(os.getenv("FAST_CONCURRENCY", "8"))
+SWEEP_CONCURRENCY = int(os.getenv("SWEEP_CONCURRENCY", "4"))
+CLASS_CONCURRENCY = {"fast": FAST_CONCURRENCY, "browser": WORKER_CONCURRENCY, "sweep": SWEEP_CONCURRENCY}
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
+# Prometheus exporter port for the first worker process (0 disables); later processes
+# take the following ports. Queue depths are sampled every QUEUE_DEPTH_INTERVAL seconds.
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+QUEUE_DEPTH_INTERVAL = 15
+# How often browser workers delete screenshot files whose job record has expired
+SCREENSHOT_PRUNE_SECONDS = int(os.getenv("SCREENSHOT_PRUNE_SECONDS", "3600"))
+# How often a sweep checks on the jobs it fanned out, and how long it waits for them
+SWEEP_POLL_SECONDS = 1.0
+SWEEP_TIMEOUT_SECONDS = int(os.getenv("SWEEP_TIMEOUT_SECONDS", "3600"))
+
+WORKER_HOST = socket.gethostname()
+
+# flipp page loads made by one browser scrape, charged against the shared rate limit
+PAGE_LOADS = {"categories": 1, "category": len(SORTING_OPTIONS), "category_delta": 1, "screenshot": 1}
+
+JOB_SECONDS = Histogram("scrape_job_seconds", "Job run time, from start to result.", ["job_type", "status"])
+QUEUE_WAIT_SECONDS = Histogram("scrape_queue_wait_seconds", "Time jobs spent queued.", ["job_class"])
+JOBS_IN_FLIGHT = Gauge("scrape_jobs_in_flight", "Jobs running in this worker.", ["job_type"])
+JOBS_SKIPPED = Counter("scrape_jobs_skipped", "Duplicate deliveries of finished jobs.", ["job_type"])
+BROWSER_POOL = Gauge("scrape_browser_pool", "Browser pool state, as reported by BrowserPool.get_stats().", ["stat"])
 
 # Redis setup
 redis_client = redis.StrictRedis(host="localhost", port=6379, db=0)
 
-# RabbitMQ setup
-connection = pika.BlockingConnection(pika.ConnectionParameters(host="localhost"))
-channel = connection.channel()
-channel.queue_declare(queue="task_queue", durable=True)
+# Per-process event loop, browser pool and (for sweeps) publisher, created in run_worker()
+loop = None
+browser_pool = None
+publisher = None
 
+# Flyer items from finished jobs are indexed for /items/search by a background writer
+item_store = ItemStore()
 
-def process_task(ch, method, properties, body):
-    task = json.loads(body)
+
+# Run a blocking call (Redis round trips, encoding a large result) on the executor, so
+# it doesn't stall every other job sharing the event loop
+def off_loop(func, *args, **kwargs):
+    return loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+# The job the running coroutine belongs to ({"job_id", "started_at"}), set by handle_task
+current_job = contextvars.ContextVar("current_job")
+
+
+# A job counts as started (in_progress, started_at) once it can actually run: browser
+# jobs only when they hold a browser or take the API fast path, not while they wait for
+# the pool after the broker handed them over
+async def mark_started():
+    job = current_job.get()
+    if "started_at" not in job:
+        job["started_at"] = time.time()
+        await off_loop(job_store.set_status, redis_client, job["job_id"], "in_progress", started_at=job["started_at"],
+                       worker_id=f"{WORKER_HOST}:{os.getpid()}")
+
+
+@asynccontextmanager
+async def browser_context():
+    async with browser_pool.context() as context:
+        await mark_started()
+        yield context
+
+
+# Serve categories/category jobs from the flipp JSON API once it has been verified, and
+# fall back to a browser scrape (which also re-runs endpoint discovery) otherwise. Sort
+# orders the API wasn't verified for are still scraped, and only those.
+async def run_flipp_job(task, scrape, *args):
+    job_type = task["type"]
+    fast_result, options = None, None
+    if await off_loop(flipp_api.is_verified, redis_client, job_type):
+        await mark_started()
+        try:
+            with span(job_type, "fast_path"):
+                fast_result = await loop.run_in_executor(None, flipp_api.fetch, redis_client, job_type, *args)
+            options = await off_loop(flipp_api.unverified_options, redis_client, job_type)
+            if not options:
+                return fast_result
+        except Exception as e:
+            await off_loop(flipp_api.invalidate, redis_client, job_type)
+            fast_result, options = None, None
+            print(f"Fast path failed for job {task['job_id']}, falling back to the browser: {e}")
+
+    with span(job_type, "rate_limit"):
+        await flipp_bucket.acquire_async(len(options) if options else PAGE_LOADS[job_type])
+    async with browser_context() as context, trace_if_slow(context, task):
+        await apply_resource_policy(context, job_type)
+        api_urls = flipp_api.capture_api_urls(context)
+        with span(job_type, "scrape"):
+            result = await (scrape(*args, context, options=options) if options else scrape(*args, context))
+
+    if options:
+        return {option: result[option] if option in options else fast_result[option] for option in SORTING_OPTIONS}
+    with span(job_type, "discover"):
+        await loop.run_in_executor(None, flipp_api.discover, redis_client, job_type, api_urls, result, *args)
+    return result
+
+
+async def scrape_category(task):
+    listings = await run_flipp_job(task, scrape_flyers_by_category, task["category"], task["postal_code"])
+    await loop.run_in_executor(None, flyer_delta.save_snapshot, redis_client, task["postal_code"], task["category"], listings, True)
+    return listings
+
+
+# Refresh a category against its last snapshot and return what changed. Without a
+# verified JSON API, only the 'latest' order is scrolled, and only until it reaches
+# flyers the snapshot already has; items are fetched only for new and changed flyers.
+async def refresh_category(task):
+    category, postal_code = task["category"], task["postal_code"]
+    snapshot = await loop.run_in_executor(None, flyer_delta.load_snapshot, redis_client, postal_code, category)
+    old_listings = snapshot["listings"] if snapshot else {}
+
+    full = flyer_delta.needs_full_refresh(snapshot) or (
+        await off_loop(flipp_api.is_verified, redis_client, "category")
+        and not await off_loop(flipp_api.unverified_options, redis_client, "category"))
+    if full:
+        listings = await run_flipp_job(task | {"type": "category"}, scrape_flyers_by_category, category, postal_code)
+    else:
+        with span("category_delta", "rate_limit"):
+            await flipp_bucket.acquire_async(PAGE_LOADS["category_delta"])
+        async with browser_context() as context, trace_if_slow(context, task):
+            await apply_resource_policy(context, "category")
+            with span("category_delta", "scrape"):
+                prefix, stopped_early = await scrape_latest_until_known(
+                    category, postal_code, flyer_delta.known_fingerprints(old_listings), context)
+        latest = flyer_delta.merge_latest(old_listings.get("latest", []), prefix, stopped_early)
+        listings = flyer_delta.patch_listings(old_listings, latest)
+
+    delta = flyer_delta.diff(old_listings, listings)
+    snapshot = await loop.run_in_executor(None, flyer_delta.save_snapshot, redis_client, postal_code, category,
+                                          listings, full, snapshot)
+    links = [listing["source_link"] for listing in delta["added"] + delta["changed"]]
+    items = await loop.run_in_executor(None, scrape_flyers, links) if links else {}
+    return {
+        "full_refresh": full,
+        "listing_hash": snapshot["listing_hash"],
+        "delta": delta,
+        "items": items,
+        "snapshot": listings,
+    }
+
+
+# Scrape each distinct market among the postal codes once, as ordinary jobs spread over
+# the worker pool, then map every postal code to its market's result
+async def run_sweep(task):
+    job = {"type": task["job"]}
+    if task["job"] == "category":
+        job["category"] = task["category"]
+    groups = await loop.run_in_executor(None, markets.group_by_market, redis_client, task["postal_codes"], flipp_api.fetch_flyers)
+    await off_loop(job_store.set_status, redis_client, task["job_id"], "in_progress", postal_codes_total=sum(map(len, groups.values())),
+                   markets_total=len(groups), markets_done=0, markets_failed=0)
+
+    # Markets already cached or being scraped by someone else are shared, not re-run
+    children = {}
+    for market, postal_codes in groups.items():
+        child = job | {"postal_code": postal_codes[0], "job_id": str(uuid.uuid4())}
+        children[market], _ = await loop.run_in_executor(None, scheduler.enqueue, redis_client, publisher, child)
+
+    pending = dict(children)
+    failed = 0
+    deadline = time.monotonic() + SWEEP_TIMEOUT_SECONDS
+    while pending and time.monotonic() < deadline:
+        await asyncio.sleep(SWEEP_POLL_SECONDS)
+        states = await loop.run_in_executor(None, job_store.get_states, redis_client, list(pending.values()))
+        finished = [(market, state) for market, state in zip(list(pending), states) if state not in ("pending", "in_progress")]
+        for market, state in finished:
+            del pending[market]
+            failed += state != "completed"
+        if finished:
+            await off_loop(job_store.set_status, redis_client, task["job_id"], "in_progress",
+                           markets_done=len(children) - len(pending), markets_failed=failed)
+
+    return await loop.run_in_executor(None, collect_sweep, groups, children)
+
+
+def collect_sweep(groups, children):
+    results = {}
+    for market, job_id in children.items():
+        entry = {"job_id": job_id, "postal_codes": groups[market]}
+        job_data = job_store.get_status(redis_client, job_id)
+        if job_data is None:
+            entry["error"] = "Job record expired."
+        elif job_data["status"] == "completed":
+            entry["result"] = job_store.load_result(redis_client, job_id, job_data)
+        elif job_data["status"] == "failed":
+            entry["error"] = job_data.get("error", "Job failed.")
+        else:
+            entry["error"] = f"Still {job_data['status']} after {SWEEP_TIMEOUT_SECONDS} s."
+        results[market] = entry
+    return {
+        "postal_codes": {postal_code: market for market, postal_codes in groups.items() for postal_code in postal_codes},
+        "markets": results,
+    }
+
+
+# Screenshots are only served while their job record exists, so a directory whose record
+# has expired is removed. Directories younger than one prune interval are left alone.
+def prune_screenshots():
+    if not os.path.isdir(SCREENSHOT_DIR):
+        return 0
+    cutoff = time.time() - SCREENSHOT_PRUNE_SECONDS
+    job_ids = [job_id for job_id in os.listdir(SCREENSHOT_DIR)
+               if os.path.getmtime(os.path.join(SCREENSHOT_DIR, job_id)) < cutoff]
+    expired = [job_id for job_id, state in zip(job_ids, job_store.get_states(redis_client, job_ids)) if state is None]
+    for job_id in expired:
+        shutil.rmtree(os.path.join(SCREENSHOT_DIR, job_id), ignore_errors=True)
+    return len(expired)
+
+
+async def prune_screenshots_periodically():
+    while True:
+        try:
+            removed = await off_loop(prune_screenshots)
+            if removed:
+                print(f"Removed {removed} expired screenshot(s).")
+        except Exception as e:
+            print(f"Could not prune screenshots: {e!r}")
+        await asyncio.sleep(SCREENSHOT_PRUNE_SECONDS)
+
+
+async def run_task(task):
+    if task["type"] == "categories":
+        return await run_flipp_job(task, scrape_flyer_categories, task["postal_code"])
+    elif task["type"] == "url":
+        # scrape_flyer is blocking; keep it off the loop so browser jobs keep running
+        return await loop.run_in_executor(None, scrape_flyer, task["url"])
+    elif task["type"] == "urls":
+        return await loop.run_in_executor(None, scrape_flyers, task["urls"])
+    elif task["type"] == "category":
+        return await scrape_category(task)
+    elif task["type"] == "category_delta":
+        return await refresh_category(task)
+    elif task["type"] == "sweep":
+        return await run_sweep(task)
+    elif task["type"] == "screenshot":
+        with span("screenshot", "rate_limit"):
+            await flipp_bucket.acquire_async(PAGE_LOADS["screenshot"])
+        async with browser_context() as context, trace_if_slow(context, task):
+            await apply_resource_policy(context, "screenshot")
+            return await scrape_flyer_screenshot(task["url"], task["job_id"], context)
+    else:
+        raise ValueError("Unknown task type.")
+
+
+async def handle_task(task):
     job_id = task["job_id"]
-    redis_client.set(job_id, json.dumps({"status": "in_progress"}))
+    job = {"job_id": job_id}
+    current_job.set(job)
 
+    # A job that failed before starting ran for no time at all
+    def timing(finished_at):
+        started_at = job.get("started_at", finished_at)
+        return task["type"], started_at - task.get("enqueued_at", started_at), finished_at - started_at
+
+    JOBS_IN_FLIGHT.inc(job_type=task["type"])
+    status = "failed"
+    # Everything up to the result is inside the try, so a Redis error or a malformed task
+    # still marks the job failed and frees its cache claim
     try:
-        if task["type"] == "categories":
-            result = asyncio.run(scrape_flyer_categories(task["postal_code"]))
-        elif task["type"] == "url":
-            result = scrape_flyer(task["url"])
-        elif task["type"] == "category":
-            result = asyncio.run(scrape_flyers_by_category(task["category"], task["postal_code"]))
-        else:
-            raise ValueError("Unknown task type.")
+        # A publish retried after a lost confirm can deliver the same job twice
+        job_data = await off_loop(job_store.get_status, redis_client, job_id)
+        if job_data and job_data["status"] in job_store.TERMINAL_STATUSES:
+            print(f"Skipping duplicate delivery of job {job_id} ({job_data['status']}).")
+            JOBS_SKIPPED.inc(job_type=task["type"])
+            status = "skipped"
+            return
+        wait_ms = await off_loop(scheduler.record_wait, redis_client, task)
+        if wait_ms is not None:
+            QUEUE_WAIT_SECONDS.observe(wait_ms / 1000, job_class=scheduler.job_class(task))
+        if scheduler.job_class(task) != "browser":
+            await mark_started()
 
-        redis_client.set(job_id, json.dumps({"status": "completed", "result": result}))
+        with profile_if_slow(task):
+            result = await run_task(task)
+        # The scrapers return None when the page never rendered what they wait for
+        if result is None:
+            raise Exception("Scrape returned no result.")
+        with span(task["type"], "save_result"):
+            result_meta = await off_loop(job_store.save_result, redis_client, job_id, result)
+        # The cache entry points at this job, so the record must live at least as long
+        ttl = max(job_store.JOB_TTLS["completed"], await off_loop(result_cache.ttl_for, task, result))
+        finished_at = time.time()
+        await off_loop(job_store.set_status, redis_client, job_id, "completed", ttl=ttl, timing=timing(finished_at),
+                       finished_at=finished_at, **result_meta)
+        await off_loop(result_cache.store, redis_client, task, result)
+        item_store.add_result(task, result)
+        status = "completed"
     except Exception as e:
-        redis_client.set(job_id, json.dumps({"status": "failed", "error": str(e)}))
+        finished_at = time.time()
+        await off_loop(job_store.set_status, redis_client, job_id, "failed", timing=timing(finished_at),
+                       finished_at=finished_at, error=str(e))
+        await off_loop(result_cache.release, redis_client, task)
+    finally:
+        JOBS_IN_FLIGHT.dec(job_type=task["type"])
+        if status != "skipped":
+            finished_at = time.time()
+            JOB_SECONDS.observe(finished_at - job.get("started_at", finished_at), job_type=task["type"], status=status)
+
+
+# Runs on the loop thread once handle_task returns. Errors that couldn't be recorded on
+# the job itself (Redis down while marking it failed, a task without a job id) end up
+# here; they are logged, and the message is still acked, since a redelivery would most
+# likely fail the same way.
+def finish_task(connection, ack, task, future):
+    error = future.exception()
+    if error is not None:
+        trace = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+        print(f"Job {task.get('job_id')} ({task.get('type')}) could not be recorded:\n{trace}")
+    connection.add_callback_threadsafe(ack)
+
+
+def process_task(connection, ch, method, properties, body):
+    task = json.loads(body)
+    future = asyncio.run_coroutine_threadsafe(handle_task(task), loop)
+
+    # Ack only once the job has finished. Channels are not thread-safe, so the ack is
+    # handed back to the connection's own thread instead of being sent from the loop.
+    ack = functools.partial(ch.basic_ack, delivery_tag=method.delivery_tag)
+    future.add_done_callback(functools.partial(finish_task, connection, ack, task))
+
+
+# Jobs published to the pre-split queue are re-routed by type rather than run here, so
+# they still go through the class queues' prefetch limits. The publish is done on this
+# channel's own thread before the ack, so a crash in between only duplicates the job,
+# and the finished-job check in handle_task skips the second delivery.
+def reroute_legacy_task(ch, method, properties, body):
+    try:
+        routing_key = scheduler.queue_for(json.loads(body))
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Dropping unroutable task from {scheduler.LEGACY_QUEUE}: {e!r}")
+        ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+        return
+    ch.basic_publish(exchange="", routing_key=routing_key, body=body,
+                     properties=pika.BasicProperties(delivery_mode=2))
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def collect_browser_pool():
+    if browser_pool is not None:
+        for stat, value in browser_pool.get_stats().items():
+            BROWSER_POOL.set(value, stat=stat)
+
+
+# Runs on the connection's thread every QUEUE_DEPTH_INTERVAL seconds
+def sample_queue_depths(connection, channel, classes):
+    try:
+        for name in classes:
+            depth = channel.queue_declare(queue=scheduler.QUEUES[name], durable=True, passive=True).method.message_count
+            QUEUE_DEPTH.set(depth, job_class=name)
+    except pika.exceptions.AMQPError as e:
+        print(f"Could not sample queue depths: {e!r}")
+    finally:
+        connection.call_later(QUEUE_DEPTH_INTERVAL, functools.partial(sample_queue_depths, connection, channel, classes))
+
+
+def run_worker(classes=WORKER_CLASSES, metrics_port=WORKER_METRICS_PORT):
+    global loop, browser_pool, publisher
+
+    # Long-lived event loop that owns the warm browser pool shared by every job, with
+    # enough executor threads for every blocking job that can run at once
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=sum(CLASS_CONCURRENCY[name] for name in classes) + 4))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    if "browser" in classes:
+        browser_pool = BrowserPool()
+        asyncio.run_coroutine_threadsafe(browser_pool.start(), loop).result()
+        asyncio.run_coroutine_threadsafe(prune_screenshots_periodically(), loop)
+    if "sweep" in classes:
+        publisher = Publisher(RABBITMQ_HOST, queues=tuple(scheduler.QUEUES.values()))
+    item_store.start_writer()
+
+    # RabbitMQ setup, one channel per job class. The broker never hands a class more
+    # unacked jobs than we run of it at once, and since jobs run on the loop thread this
+    # thread is free to service heartbeats.
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
+    for name in classes:
+        channel = connection.channel()
+        channel.queue_declare(queue=scheduler.QUEUES[name], durable=True)
+        channel.basic_qos(prefetch_count=CLASS_CONCURRENCY[name])
+        channel.basic_consume(queue=scheduler.QUEUES[name], on_message_callback=functools.partial(process_task, connection))
+    if scheduler.LEGACY_QUEUE:
+        legacy_channel = connection.channel()
+        legacy_channel.queue_declare(queue=scheduler.LEGACY_QUEUE, durable=True)
+        for queue_name in scheduler.QUEUES.values():
+            legacy_channel.queue_declare(queue=queue_name, durable=True)
+        legacy_channel.basic_qos(prefetch_count=100)
+        legacy_channel.basic_consume(queue=scheduler.LEGACY_QUEUE, on_message_callback=reroute_legacy_task)
+
+    if metrics_port:
+        REGISTRY.on_collect(collect_browser_pool)
+        start_exporter(metrics_port)
+        sample_queue_depths(connection, channel, classes)
+
+    limits = ", ".join(f"{name}: {CLASS_CONCURRENCY[name]} at a time" for name in classes)
+    print(f"Worker {os.getpid()} is ready to process tasks ({limits}).")
+    try:
+        # Consuming on one channel dispatches deliveries for every channel on the connection
+        channel.start_consuming()
     finally:
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        if browser_pool is not None:
+            asyncio.run_coroutine_threadsafe(browser_pool.close(), loop).result()
 
 
-channel.basic_consume(queue="task_queue", on_message_callback=process_task)
-print("Worker is ready to process tasks.")
-channel.start_consuming()
+if __name__ == "__main__":
+    if WORKER_PROCESSES > 1:
+        # One consumer, event loop and browser pool per process to use every core
+        processes = [
+            multiprocessing.Process(target=run_worker, kwargs={"metrics_port": WORKER_METRICS_PORT + number if WORKER_METRICS_PORT else 0})
+            for number in range(WORKER_PROCESSES)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    else:
+        run_worker()
@@ -0,0 +1,119 @@
+"""Latency benchmark for the userManage endpoints, run against a throwaway database.
+
+    python -m pytest -q userManage/tests
+
+Each endpoint is called ROUNDS times through the Flask test client; the test fails if
+its p95 exceeds BENCH_P95_MS. Missing users must get a 404 rather than a silent 200.
+"""
+import os
+import sys
+import time
+import queue
+import importlib
+
+import pytest
+
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "200"))
+P95_BUDGET_MS = float(os.getenv("BENCH_P95_MS", "25"))
+
+USER_MANAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    # main.py sets up logs/ relative to the working directory on import
+    workdir = tmp_path_factory.mktemp("usermanage")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, USER_MANAGE_DIR)
+    try:
+        main = importlib.import_module("main")
+        main.DB_NAME = str(workdir / "user_management.db")
+        main.connection_pool = queue.LifoQueue()
+        main.init_db()
+        yield main
+    finally:
+        sys.path.remove(USER_MANAGE_DIR)
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def p95_ms(call, rounds=ROUNDS):
+    timings = []
+    for number in range(rounds):
+        started = time.perf_counter()
+        call(number)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[min(len(timings) - 1, int(0.95 * len(timings)))]
+
+
+def check_budget(name, p95):
+    print(f"{name}: p95 {p95:.2f} ms")
+    assert p95 < P95_BUDGET_MS, f"{name} p95 {p95:.2f} ms exceeds {P95_BUDGET_MS} ms"
+
+
+def test_create_user_latency(client):
+    def call(number):
+        response = client.post("/user", json={"email": f"create{number}@example.com", "username": f"create{number}"})
+        assert response.status_code == 201
+
+    check_budget("POST /user", p95_ms(call))
+
+
+def test_edit_user_latency(client):
+    client.post("/user", json={"email": "edit@example.com", "username": "edit"})
+
+    def call(number):
+        response = client.put("/user/edit@example.com", json={"username": f"edit{number}"})
+        assert response.status_code == 200
+
+    check_budget("PUT /user/<email>", p95_ms(call))
+
+
+def test_delete_user_latency(client):
+    for number in range(ROUNDS):
+        client.post("/user", json={"email": f"delete{number}@example.com", "username": f"delete{number}"})
+
+    def call(number):
+        response = client.delete(f"/user/delete{number}@example.com")
+        assert response.status_code == 200
+
+    check_budget("DELETE /user/<email>", p95_ms(call))
+
+
+def test_create_api_key_latency(client):
+    client.post("/user", json={"email": "key@example.com", "username": "key"})
+
+    def call(number):
+        response = client.post("/user/key@example.com/api_key")
+        assert response.status_code == 200
+        assert len(response.json["api_key"]) == 64
+
+    check_budget("POST /user/<email>/api_key", p95_ms(call))
+
+
+def test_regenerate_api_key_latency(client):
+    client.post("/user", json={"email": "rekey@example.com", "username": "rekey"})
+    client.post("/user/rekey@example.com/api_key")
+
+    def call(number):
+        response = client.put("/user/rekey@example.com/api_key")
+        assert response.status_code == 200
+
+    check_budget("PUT /user/<email>/api_key", p95_ms(call))
+
+
+@pytest.mark.parametrize("method, path, body", [
+    ("put", "/user/missing@example.com", {"username": "nobody"}),
+    ("delete", "/user/missing@example.com", None),
+    ("post", "/user/missing@example.com/api_key", None),
+    ("put", "/user/missing@example.com/api_key", None),
+])
+def test_missing_user_is_404(client, method, path, body):
+    response = getattr(client, method)(path, json=body)
+    assert response.status_code == 404